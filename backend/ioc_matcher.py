@@ -0,0 +1,299 @@
+"""In-process matching of log data against curated threat hunt IOCs.
+
+Every IOC type is a delimited token (ip, domain, hash, url, email), so lines are
+tokenized with compiled regexes and each token is resolved with hash lookups:
+domains walk their parent suffixes, IPs are masked once per CIDR prefix length,
+URLs are looked up by host and walk their parent paths.
+"""
+import ipaddress
+import re
+import socket
+from typing import Dict, Iterable, List, Optional, Tuple
+
+HASH_TYPES = {32: "md5", 40: "sha1", 64: "sha256", 128: "sha512"}
+
+URL_PATTERN = re.compile(r'[a-zA-Z][a-zA-Z0-9+.-]*://[^\s"\'<>\\]+')
+# The second alternative catches compressed IPv6 such as ::1 inside [::1]:443
+TOKEN_PATTERN = re.compile(r'(?:::)?[A-Za-z0-9_][A-Za-z0-9._@:%+-]*[A-Za-z0-9]|::[0-9A-Fa-f]')
+IPV4_OCTET = r'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+IPV4_PATTERN = re.compile(rf'{IPV4_OCTET}(?:\.{IPV4_OCTET}){{3}}')
+HEX_PATTERN = re.compile(r'^[0-9a-f]+$')
+URL_SUFFIX_PATTERN = re.compile(r'[?#]')
+
+def normalize_domain(value: str) -> Optional[str]:
+    value = value.strip().lower().rstrip('.')
+    if value.startswith('*.'):
+        value = value[2:]
+    if not value or ' ' in value or '.' not in value:
+        return None
+    try:
+        return value.encode('idna').decode('ascii')
+    except UnicodeError:
+        return value
+
+def normalize_ip(value: str) -> Optional[str]:
+    """Canonical address, or network for CIDR values"""
+    value = value.strip()
+    try:
+        if '/' in value:
+            return str(ipaddress.ip_network(value, strict=False))
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return None
+
+def normalize_hash(value: str) -> Optional[str]:
+    value = value.strip().lower()
+    if len(value) in HASH_TYPES and HEX_PATTERN.match(value):
+        return value
+    return None
+
+def hash_type(value: str) -> Optional[str]:
+    return HASH_TYPES.get(len(value))
+
+def normalize_url(value: str) -> Optional[str]:
+    value = value.strip()
+    if not value:
+        return None
+    if '://' not in value:
+        value = f"http://{value}"
+    scheme, rest = value.split('://', 1)
+    host, sep, path = rest.partition('/')
+    normalized = f"{scheme.lower()}://{host.lower()}{sep}{path}"
+    return normalized.rstrip('/')
+
+def normalize_email(value: str) -> Optional[str]:
+    value = value.strip().lower()
+    local, sep, domain = value.partition('@')
+    if not local or not sep or '.' not in domain:
+        return None
+    return value
+
+def url_match_key(value: str) -> Tuple[str, str]:
+    """(host, path) of a URL without scheme, credentials, default port, query or fragment"""
+    rest = value.split('://', 1)[-1]
+    rest = URL_SUFFIX_PATTERN.split(rest, 1)[0]
+    host, _, path = rest.partition('/')
+    host = host.rpartition('@')[2].lower().rstrip('.')
+    for port in (':80', ':443'):
+        if host.endswith(port):
+            host = host[:-len(port)]
+    path = path.rstrip('/')
+    return host, f"/{path}" if path else ""
+
+NORMALIZERS = {
+    "ip": normalize_ip,
+    "domain": normalize_domain,
+    "hash": normalize_hash,
+    "url": normalize_url,
+    "email": normalize_email
+}
+
+def normalize_ioc(ioc_type: str, value: str) -> Optional[str]:
+    """Canonical form of an IOC value, or None when it is not valid for its type"""
+    normalizer = NORMALIZERS.get(ioc_type)
+    if not normalizer or not isinstance(value, str):
+        return None
+    return normalizer(value)
+
+class IOCMatcher:
+    """Lookup tables built from IOCs; add/remove keep them current without a full rebuild"""
+
+    def __init__(self):
+        # Reference counts so duplicate IOCs can be removed one at a time
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.exact: Dict[str, set] = {"domain": set(), "hash": set(), "email": set(), "ip": set()}
+        # prefix length -> set of network integers, per IP version
+        self.networks: Dict[Tuple[int, int], set] = {}
+        # host -> path -> stored URLs, so http/https and query strings still match
+        self.urls: Dict[str, Dict[str, set]] = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _network_key(self, value: str) -> Optional[Tuple[Tuple[int, int], int]]:
+        network = ipaddress.ip_network(value, strict=False)
+        if network.prefixlen == network.max_prefixlen:
+            return None
+        return (network.version, network.prefixlen), int(network.network_address)
+
+    def add(self, ioc_type: str, value: str):
+        value = normalize_ioc(ioc_type, value)
+        if not value:
+            return
+        key = (ioc_type, value)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.counts[key] > 1:
+            return
+        if ioc_type == "ip":
+            network_key = self._network_key(value)
+            if network_key:
+                prefix, address = network_key
+                self.networks.setdefault(prefix, set()).add(address)
+                return
+        if ioc_type == "url":
+            host, path = url_match_key(value)
+            self.urls.setdefault(host, {}).setdefault(path, set()).add(value)
+            return
+        self.exact[ioc_type].add(value)
+
+    def remove(self, ioc_type: str, value: str):
+        value = normalize_ioc(ioc_type, value)
+        key = (ioc_type, value)
+        if not value or key not in self.counts:
+            return
+        self.counts[key] -= 1
+        if self.counts[key]:
+            return
+        del self.counts[key]
+        if ioc_type == "ip":
+            network_key = self._network_key(value)
+            if network_key:
+                prefix, address = network_key
+                self.networks.get(prefix, set()).discard(address)
+                return
+        if ioc_type == "url":
+            host, path = url_match_key(value)
+            paths = self.urls.get(host, {})
+            paths.get(path, set()).discard(value)
+            if not paths.get(path, True):
+                del paths[path]
+            if not paths:
+                self.urls.pop(host, None)
+            return
+        self.exact[ioc_type].discard(value)
+
+    def _match_ip(self, token: str) -> Optional[str]:
+        if ':' in token:
+            try:
+                address = ipaddress.IPv6Address(token)
+            except ValueError:
+                return None
+            version, number, bits = 6, int(address), 128
+            canonical = str(address)
+        else:
+            # Only canonical dotted quads reach inet_aton, which would otherwise accept
+            # short forms (version strings, plain integers) and octal octets
+            if not IPV4_PATTERN.fullmatch(token):
+                return None
+            version, number, bits = 4, int.from_bytes(socket.inet_aton(token), 'big'), 32
+            canonical = token
+        if canonical in self.exact["ip"]:
+            return canonical
+        for (net_version, prefixlen), addresses in self.networks.items():
+            if net_version != version:
+                continue
+            masked = number >> (bits - prefixlen) << (bits - prefixlen)
+            if masked in addresses:
+                return f"{ipaddress.ip_address(masked)}/{prefixlen}"
+        return None
+
+    def _match_domain(self, token: str) -> Optional[str]:
+        domains = self.exact["domain"]
+        parts = token.split('.')
+        for i in range(len(parts) - 1):
+            candidate = '.'.join(parts[i:])
+            if candidate in domains:
+                return candidate
+        return None
+
+    def _match_url(self, url: str) -> Optional[str]:
+        host, path = url_match_key(url)
+        paths = self.urls.get(host)
+        if not paths:
+            return None
+        # Most specific IOC first: /a/b/c, /a/b, /a, then the bare host
+        segments = path.split('/')
+        for i in range(len(segments), 0, -1):
+            candidate = '/'.join(segments[:i])
+            if candidate in paths:
+                return min(paths[candidate])
+        return None
+
+    def match_text(self, text: str) -> List[dict]:
+        """All IOC hits in a piece of text as {"type", "ioc", "value"} dicts"""
+        matches = []
+        exact = self.exact
+        has_ips = exact["ip"] or self.networks
+
+        if self.urls:
+            for url in URL_PATTERN.findall(text):
+                ioc = self._match_url(url.rstrip('.,;)'))
+                if ioc:
+                    matches.append({"type": "url", "ioc": ioc, "value": url})
+
+        for token in TOKEN_PATTERN.findall(text):
+            lowered = token.lower()
+            if exact["hash"] and len(lowered) in HASH_TYPES and lowered in exact["hash"]:
+                matches.append({"type": "hash", "ioc": lowered, "value": token})
+                continue
+            if '@' in lowered:
+                if lowered in exact["email"]:
+                    matches.append({"type": "email", "ioc": lowered, "value": token})
+                lowered = lowered.rpartition('@')[2]
+            # host:port as written by firewalls and proxies; IPv6 has no dot before its last colon
+            host, sep, port = lowered.rpartition(':')
+            if sep and port.isdigit() and '.' in host:
+                lowered = host
+            if has_ips and (lowered[0].isdigit() or ':' in lowered):
+                ioc = self._match_ip(lowered)
+                if ioc:
+                    matches.append({"type": "ip", "ioc": ioc, "value": token})
+                    continue
+            if exact["domain"] and '.' in lowered:
+                ioc = self._match_domain(lowered)
+                if ioc:
+                    matches.append({"type": "domain", "ioc": ioc, "value": token})
+        return matches
+
+def build_matcher(iocs: Iterable[dict]) -> IOCMatcher:
+    matcher = IOCMatcher()
+    for ioc in iocs:
+        matcher.add(ioc.get("type"), ioc.get("value"))
+    return matcher
+
+STIX_OBJECT_TYPES = {
+    "ipv4-addr": "ip",
+    "ipv6-addr": "ip",
+    "domain-name": "domain",
+    "url": "url",
+    "email-addr": "email",
+    "file": "hash"
+}
+STIX_COMPARISON = re.compile(r"([a-z0-9-]+):([A-Za-z0-9_.'-]+)\s*=\s*'((?:[^'\\]|\\.)*)'")
+
+def detect_ioc_type(value: str) -> Optional[str]:
+    """Best-effort IOC type for a bare value"""
+    value = value.strip()
+    if '://' in value:
+        return "url"
+    if '@' in value:
+        return "email"
+    if normalize_ip(value):
+        return "ip"
+    if normalize_hash(value):
+        return "hash"
+    if normalize_domain(value) and '/' not in value:
+        return "domain"
+    return None
+
+def stix_indicators(bundle: dict) -> Iterable[dict]:
+    """IOCs from the indicator patterns and cyber-observables of a STIX 2.x bundle"""
+    objects = bundle.get("objects", []) if isinstance(bundle, dict) else []
+    for obj in objects:
+        if not isinstance(obj, dict):
+            continue
+        obj_type = obj.get("type")
+        if obj_type == "indicator":
+            description = obj.get("description") or obj.get("name") or ""
+            for object_type, path, value in STIX_COMPARISON.findall(obj.get("pattern", "")):
+                ioc_type = STIX_OBJECT_TYPES.get(object_type)
+                if ioc_type == "hash" and not path.startswith("hashes"):
+                    continue
+                if ioc_type:
+                    yield {"type": ioc_type, "value": value.replace("\\'", "'"), "description": description}
+        elif obj_type in STIX_OBJECT_TYPES:
+            if obj_type == "file":
+                for value in (obj.get("hashes") or {}).values():
+                    yield {"type": "hash", "value": value, "description": obj.get("name", "")}
+            elif obj.get("value"):
+                yield {"type": STIX_OBJECT_TYPES[obj_type], "value": obj["value"], "description": ""}
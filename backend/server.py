@@ -1,9 +1,12 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, BackgroundTasks, Query, Response, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import StreamingResponse
+from starlette.requests import ClientDisconnect
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -18,23 +21,30 @@ from emergentintegrations.llm.chat import LlmChat, UserMessage
 import aiohttp
 from bs4 import BeautifulSoup
 import feedparser
+from cachetools import TTLCache
 import json
 import re
 import io
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib import colors
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
+import csv
+import tempfile
+import hashlib
+import base64
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from weekly_report import render_weekly_report, render_full_weekly_report, REPORT_DETAIL_LIMIT
+from ioc_matcher import IOCMatcher, build_matcher, normalize_ioc, detect_ioc_type, hash_type, stix_indicators
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# tz_aware so stored BSON dates come back as UTC datetimes
+client = AsyncIOMotorClient(mongo_url, tz_aware=True)
 db = client[os.environ['DB_NAME']]
+report_files = AsyncIOMotorGridFSBucket(db, bucket_name="weekly_reports")
 
 # JWT Configuration
 JWT_SECRET = os.environ['JWT_SECRET']
@@ -116,12 +126,35 @@ class AttackProfile(BaseModel):
 
 # ==================== UTILITIES ====================
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the event loop
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+password_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '4')),
+    thread_name_prefix="bcrypt"
+)
+
+def _hash_password(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
 
-def verify_password(password: str, hashed: str) -> bool:
+def _verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
+async def hash_password(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, _hash_password, password)
+
+async def verify_password(password: str, hashed: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(password_executor, _verify_password, password, hashed)
+
+def as_datetime(value) -> datetime:
+    """Accept both BSON dates and the ISO strings stored before the datetime migration"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
 def create_jwt_token(user_id: str, email: str) -> str:
     payload = {
         "user_id": user_id,
@@ -139,14 +172,81 @@ def verify_jwt_token(token: str) -> Dict[str, Any]:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Verified user records keyed by user_id, so authenticated requests skip the users lookup
+USER_CACHE_TTL_SECONDS = int(os.environ.get('USER_CACHE_TTL_SECONDS', '300'))
+user_cache = TTLCache(maxsize=int(os.environ.get('USER_CACHE_SIZE', '10000')), ttl=USER_CACHE_TTL_SECONDS)
+
+def invalidate_cached_user(user_id: str):
+    user_cache.pop(user_id, None)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     payload = verify_jwt_token(token)
-    user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    user = user_cache.get(payload["user_id"])
+    if user is None:
+        user = await db.users.find_one({"id": payload["user_id"]}, {"_id": 0})
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache[payload["user_id"]] = user
     return user
 
+async def get_token_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """Principal built from verified JWT claims alone, for read-only routes"""
+    payload = verify_jwt_token(credentials.credentials)
+    if payload.get("user_id") == "admin":
+        raise HTTPException(status_code=401, detail="User not found")
+    return {"id": payload["user_id"], "email": payload.get("email")}
+
+# Keyset pagination over (discovered_at, id), newest first
+MAX_PAGE_SIZE = 500
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+FIELD_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+# Number of latest links kept on the tenant summary; also the first timeline page
+SUMMARY_RECENT_LIMIT = 50
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([as_datetime(doc['discovered_at']).isoformat(), doc.get('id')])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        discovered_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(discovered_at), doc_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def build_projection(fields: Optional[str]) -> dict:
+    """Projection for a comma-separated fields= parameter; id and discovered_at are always kept for the cursor"""
+    projection = {"_id": 0}
+    if not fields:
+        return projection
+    for field in fields.split(','):
+        field = field.strip()
+        if not field:
+            continue
+        if not FIELD_NAME_PATTERN.match(field):
+            raise HTTPException(status_code=400, detail=f"Invalid field: {field}")
+        projection[field] = 1
+    projection["id"] = 1
+    projection["discovered_at"] = 1
+    return projection
+
+async def paginate(collection, query: dict, projection: dict, limit: int, cursor: Optional[str], response: Response) -> List[dict]:
+    """Fetch one page and expose the cursor for the next one in a response header"""
+    if cursor:
+        discovered_at, doc_id = decode_cursor(cursor)
+        query = {**query, "$or": [
+            {"discovered_at": {"$lt": discovered_at}},
+            {"discovered_at": discovered_at, "id": {"$lt": doc_id}}
+        ]}
+    docs = await collection.find(query, projection).sort(
+        [("discovered_at", -1), ("id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    if len(docs) > limit:
+        docs = docs[:limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    return docs
+
 # ==================== AUTH ENDPOINTS ====================
 
 @api_router.post("/auth/register")
@@ -157,11 +257,11 @@ async def register(user_data: UserRegister, background_tasks: BackgroundTasks):
     
     user = User(
         email=user_data.email,
-        password_hash=hash_password(user_data.password)
+        password_hash=await hash_password(user_data.password)
     )
     user_dict = user.model_dump()
-    user_dict['created_at'] = user_dict['created_at'].isoformat()
     await db.users.insert_one(user_dict)
+    invalidate_cached_user(user.id)
     
     profile = CompanyProfile(
         user_id=user.id,
@@ -180,8 +280,8 @@ async def register(user_data: UserRegister, background_tasks: BackgroundTasks):
         }
     )
     profile_dict = profile.model_dump()
-    profile_dict['created_at'] = profile_dict['created_at'].isoformat()
     await db.profiles.insert_one(profile_dict)
+    profile_tag_index.add(profile.user_id, profile.tags)
     
     # Match existing attacks to new user immediately
     background_tasks.add_task(match_user_to_existing_attacks, profile)
@@ -197,7 +297,7 @@ async def register(user_data: UserRegister, background_tasks: BackgroundTasks):
 @api_router.post("/auth/login")
 async def login(credentials: UserLogin):
     user = await db.users.find_one({"email": credentials.email}, {"_id": 0})
-    if not user or not verify_password(credentials.password, user["password_hash"]):
+    if not user or not await verify_password(credentials.password, user["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_jwt_token(user["id"], user["email"])
@@ -243,35 +343,37 @@ async def update_profile(profile_data: dict, current_user: dict = Depends(get_cu
         {"user_id": current_user["id"]},
         {"$set": profile_data}
     )
+    if 'tags' in profile_data:
+        profile_tag_index.add(current_user["id"], profile_data['tags'])
+    geo_map_cache.pop(current_user["id"], None)
     return {"message": "Profile updated successfully"}
 
 # ==================== DASHBOARD ENDPOINTS ====================
 
 @api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
+async def get_dashboard_stats(current_user: dict = Depends(get_token_user)):
     profile = await db.profiles.find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    matched_attacks = await db.user_attacks.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(1000)
+    summary = await get_tenant_summary(current_user["id"])
+    severity_counts = summary["severity"]
+    daily_counts = summary["daily"]
     
-    total_threats = len(matched_attacks)
-    critical_threats = len([a for a in matched_attacks if a.get("severity") == "Critical"])
-    high_threats = len([a for a in matched_attacks if a.get("severity") == "High"])
-    medium_threats = len([a for a in matched_attacks if a.get("severity") == "Medium"])
-    low_threats = len([a for a in matched_attacks if a.get("severity") == "Low"])
+    total_threats = summary["total"]
+    critical_threats = severity_counts.get("Critical", 0)
+    high_threats = severity_counts.get("High", 0)
+    medium_threats = severity_counts.get("Medium", 0)
+    low_threats = severity_counts.get("Low", 0)
     
     # Trend data for last 7 days
     now = datetime.now(timezone.utc)
     trends = []
     for i in range(6, -1, -1):
         day = now - timedelta(days=i)
-        day_start = day.replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-        day_end = day.replace(hour=23, minute=59, second=59, microsecond=999999).isoformat()
-        count = len([a for a in matched_attacks if day_start <= a.get('discovered_at', '') <= day_end])
         trends.append({
             "date": day.strftime("%m/%d"),
-            "threats": count
+            "threats": daily_counts.get(day.strftime("%Y-%m-%d"), 0)
         })
     
     return {
@@ -287,29 +389,46 @@ async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
 
 @api_router.get("/dashboard/attacks")
 async def get_attacks(
+    response: Response,
     severity: Optional[str] = None,
     search: Optional[str] = None,
-    current_user: dict = Depends(get_current_user)
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    current_user: dict = Depends(get_token_user)
 ):
     query = {"user_id": current_user["id"]}
     if severity and severity != "all":
         query["severity"] = severity.capitalize()
+    projection = build_projection(fields)
     
-    matched_attacks = await db.user_attacks.find(query, {"_id": 0}).sort("discovered_at", -1).to_list(100)
+    if not search:
+        return await paginate(db.user_attacks, query, projection, limit, cursor, response)
     
-    if search:
-        search_lower = search.lower()
-        matched_attacks = [a for a in matched_attacks if search_lower in a.get('name', '').lower() or search_lower in a.get('description', '').lower()]
+    # Ranked search over the tenant's full history through the user_attacks text index
+    # Results are ranked by relevance, so search returns a single page without a cursor
+    matched_attacks = await db.user_attacks.find(
+        {**query, "$text": {"$search": search}},
+        {**projection, "score": {"$meta": "textScore"}}
+    ).sort([("score", {"$meta": "textScore"}), ("discovered_at", -1)]).to_list(limit)
+    
+    if not matched_attacks:
+        # Text search matches whole words; fall back to substrings for fragments like partial IOCs
+        pattern = {"$regex": re.escape(search), "$options": "i"}
+        matched_attacks = await db.user_attacks.find(
+            {**query, "$or": [{"name": pattern}, {"description": pattern}, {"threat_actor": pattern}, {"ttps": pattern}, {"iocs": pattern}]},
+            projection
+        ).sort("discovered_at", -1).to_list(limit)
     
+    for attack in matched_attacks:
+        attack.pop("score", None)
     return matched_attacks
 
 @api_router.get("/dashboard/rules/{attack_id}")
-async def get_attack_rules(attack_id: str, current_user: dict = Depends(get_current_user)):
-    yara_rules = await db.yara_rules.find({"attack_id": attack_id}, {"_id": 0}).to_list(100)
-    sigma_rules = await db.sigma_rules.find({"attack_id": attack_id}, {"_id": 0}).to_list(100)
-    
+async def get_attack_rules(attack_id: str, current_user: dict = Depends(get_token_user)):
     # Get attack details for mitigation
     attack = await db.attacks.find_one({"id": attack_id}, {"_id": 0})
+    yara_rules, sigma_rules = await current_attack_rules(attack_id, attack)
     mitigations = []
     if attack:
         # Use Gemini-generated mitigations if available
@@ -337,119 +456,145 @@ async def get_attack_rules(attack_id: str, current_user: dict = Depends(get_curr
     }
 
 @api_router.get("/dashboard/analytics")
-async def get_analytics(current_user: dict = Depends(get_current_user)):
-    matched_attacks = await db.user_attacks.find({"user_id": current_user["id"]}, {"_id": 0}).to_list(1000)
+async def get_analytics(current_user: dict = Depends(get_token_user)):
+    summary = await get_tenant_summary(current_user["id"])
     
     # Severity distribution
     severity_dist = {
-        "Critical": len([a for a in matched_attacks if a.get("severity") == "Critical"]),
-        "High": len([a for a in matched_attacks if a.get("severity") == "High"]),
-        "Medium": len([a for a in matched_attacks if a.get("severity") == "Medium"]),
-        "Low": len([a for a in matched_attacks if a.get("severity") == "Low"])
+        "Critical": summary["severity"].get("Critical", 0),
+        "High": summary["severity"].get("High", 0),
+        "Medium": summary["severity"].get("Medium", 0),
+        "Low": summary["severity"].get("Low", 0)
     }
     
     # Top threat actors
-    threat_actors = {}
-    for attack in matched_attacks:
-        actor = attack.get('threat_actor', 'Unknown')
-        threat_actors[actor] = threat_actors.get(actor, 0) + 1
-    
-    top_actors = sorted(threat_actors.items(), key=lambda x: x[1], reverse=True)[:5]
+    top_actors = sorted(summary["threat_actors"].items(), key=lambda x: x[1], reverse=True)[:5]
     
     return {
         "severity_distribution": severity_dist,
-        "top_threat_actors": [{"name": actor, "count": count} for actor, count in top_actors]
+        "top_threat_actors": [{"name": decode_summary_key(actor), "count": count} for actor, count in top_actors]
     }
 
 @api_router.get("/dashboard/timeline")
-async def get_timeline(current_user: dict = Depends(get_current_user)):
-    matched_attacks = await db.user_attacks.find(
+async def get_timeline(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(SUMMARY_RECENT_LIMIT, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_token_user)
+):
+    if not cursor and limit <= SUMMARY_RECENT_LIMIT:
+        # The first page is already on the tenant summary
+        summary = await get_tenant_summary(current_user["id"])
+        recent = summary["recent"]
+        if summary["total"] > limit and len(recent) >= limit:
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor({
+                "discovered_at": recent[limit - 1]["timestamp"],
+                "id": recent[limit - 1]["id"]
+            })
+        return recent[:limit]
+    
+    links = await paginate(
+        db.user_attacks,
         {"user_id": current_user["id"]},
-        {"_id": 0}
-    ).sort("discovered_at", -1).limit(50).to_list(50)
-    
-    timeline = []
-    for attack in matched_attacks:
-        timeline.append({
-            "id": attack.get('id'),
-            "attack_id": attack.get('attack_id'),
-            "name": attack.get('name'),
-            "severity": attack.get('severity'),
-            "timestamp": attack.get('discovered_at')
-        })
-    
-    return timeline
+        {"_id": 0, "id": 1, "attack_id": 1, "name": 1, "severity": 1, "discovered_at": 1},
+        limit,
+        cursor,
+        response
+    )
+    return [timeline_entry(link) for link in links]
+
+# Region to coordinates mapping
+REGION_COORDINATES = {
+    "North America": {"lat": 40.7128, "lon": -74.0060, "name": "New York, USA"},
+    "Europe": {"lat": 51.5074, "lon": -0.1278, "name": "London, UK"},
+    "Asia": {"lat": 35.6762, "lon": 139.6503, "name": "Tokyo, Japan"},
+    "Middle East": {"lat": 25.2048, "lon": 55.2708, "name": "Dubai, UAE"},
+    "Latin America": {"lat": -23.5505, "lon": -46.6333, "name": "São Paulo, Brazil"},
+    "Africa": {"lat": -1.2864, "lon": 36.8172, "name": "Nairobi, Kenya"},
+    "Oceania": {"lat": -33.8688, "lon": 151.2093, "name": "Sydney, Australia"},
+    "Global": {"lat": 0, "lon": 0, "name": "Global"}
+}
+
+# Per-tenant geo map responses, invalidated when new attack links are written
+geo_map_cache = TTLCache(maxsize=10000, ttl=300)
+
+def count_severity(level: str) -> dict:
+    return {"$sum": {"$cond": [{"$eq": ["$severity", level]}, 1, 0]}}
 
 @api_router.get("/dashboard/geo-map")
-async def get_geo_map(current_user: dict = Depends(get_current_user)):
+async def get_geo_map(current_user: dict = Depends(get_token_user)):
     """Get geographic distribution of attacks"""
+    cached = geo_map_cache.get(current_user["id"])
+    if cached is not None:
+        return cached
+    
     profile = await db.profiles.find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    # Get all attacks with location data
-    matched_attacks = await db.user_attacks.find(
-        {"user_id": current_user["id"]},
-        {"_id": 0}
-    ).to_list(1000)
-    
-    # Region to coordinates mapping
-    region_coords = {
-        "North America": {"lat": 40.7128, "lon": -74.0060, "name": "New York, USA"},
-        "Europe": {"lat": 51.5074, "lon": -0.1278, "name": "London, UK"},
-        "Asia": {"lat": 35.6762, "lon": 139.6503, "name": "Tokyo, Japan"},
-        "Middle East": {"lat": 25.2048, "lon": 55.2708, "name": "Dubai, UAE"},
-        "Latin America": {"lat": -23.5505, "lon": -46.6333, "name": "São Paulo, Brazil"},
-        "Africa": {"lat": -1.2864, "lon": 36.8172, "name": "Nairobi, Kenya"},
-        "Oceania": {"lat": -33.8688, "lon": 151.2093, "name": "Sydney, Australia"},
-        "Global": {"lat": 0, "lon": 0, "name": "Global"}
-    }
-    
-    # Aggregate attacks by region
-    location_data = {}
-    for attack in matched_attacks:
-        # Get attack details to find regions
-        attack_details = await db.attacks.find_one({"id": attack.get("attack_id")}, {"_id": 0})
-        if attack_details:
-            regions = attack_details.get('tags', {}).get('regions', ['Global'])
-            for region in regions:
-                if region not in location_data:
-                    location_data[region] = {
-                        "region": region,
-                        "coordinates": region_coords.get(region, {"lat": 0, "lon": 0, "name": region}),
-                        "attacks": [],
-                        "total": 0,
-                        "critical": 0,
-                        "high": 0,
-                        "medium": 0,
-                        "low": 0
-                    }
-                
-                location_data[region]["attacks"].append({
-                    "id": attack.get('id'),
-                    "name": attack.get('name'),
-                    "severity": attack.get('severity'),
-                    "discovered_at": attack.get('discovered_at')
-                })
-                location_data[region]["total"] += 1
-                
-                severity = attack.get('severity', 'Low')
-                location_data[region][severity.lower()] += 1
+    # Join each link to its attack's regions and group per region in one round trip
+    regions = await db.user_attacks.aggregate([
+        {"$match": {"user_id": current_user["id"]}},
+        {"$lookup": {
+            "from": "attacks",
+            "localField": "attack_id",
+            "foreignField": "id",
+            "as": "attack"
+        }},
+        {"$unwind": "$attack"},
+        {"$project": {
+            "_id": 0,
+            "id": 1,
+            "name": 1,
+            "severity": 1,
+            "discovered_at": 1,
+            "regions": {"$ifNull": ["$attack.tags.regions", ["Global"]]}
+        }},
+        {"$unwind": "$regions"},
+        {"$group": {
+            "_id": "$regions",
+            "attacks": {"$push": {
+                "id": "$id",
+                "name": "$name",
+                "severity": "$severity",
+                "discovered_at": "$discovered_at"
+            }},
+            "total": {"$sum": 1},
+            "critical": count_severity("Critical"),
+            "high": count_severity("High"),
+            "medium": count_severity("Medium"),
+            "low": count_severity("Low")
+        }}
+    ]).to_list(None)
+    
+    locations = []
+    for region in regions:
+        locations.append({
+            "region": region["_id"],
+            "coordinates": REGION_COORDINATES.get(region["_id"], {"lat": 0, "lon": 0, "name": region["_id"]}),
+            "attacks": region["attacks"],
+            "total": region["total"],
+            "critical": region["critical"],
+            "high": region["high"],
+            "medium": region["medium"],
+            "low": region["low"]
+        })
     
-    return {
+    geo_map = {
         "user_region": profile.get('region'),
-        "locations": list(location_data.values())
+        "locations": locations
     }
+    geo_map_cache[current_user["id"]] = geo_map
+    return geo_map
 
 @api_router.post("/dashboard/export-rules/{attack_id}")
-async def export_rules(attack_id: str, rule_type: str, current_user: dict = Depends(get_current_user)):
+async def export_rules(attack_id: str, rule_type: str, current_user: dict = Depends(get_token_user)):
+    yara_rules, sigma_rules = await current_attack_rules(attack_id)
     if rule_type == "yara":
-        rules = await db.yara_rules.find({"attack_id": attack_id}, {"_id": 0}).to_list(100)
-        content = "\n\n".join([r['rule_content'] for r in rules])
+        content = "\n\n".join([r['rule_content'] for r in yara_rules])
         filename = f"yara_rules_{attack_id}.yar"
     else:
-        rules = await db.sigma_rules.find({"attack_id": attack_id}, {"_id": 0}).to_list(100)
-        content = "\n---\n".join([r['rule_content'] for r in rules])
+        content = "\n---\n".join([r['rule_content'] for r in sigma_rules])
         filename = f"sigma_rules_{attack_id}.yml"
     
     return StreamingResponse(
@@ -458,151 +603,161 @@ async def export_rules(attack_id: str, rule_type: str, current_user: dict = Depe
         headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+# Weekly reports render in a separate process pool; spawn avoids forking the event loop's threads
+report_executor = ProcessPoolExecutor(
+    max_workers=int(os.environ.get('REPORT_RENDER_WORKERS', '2')),
+    mp_context=multiprocessing.get_context("spawn")
+)
+# Full reports take minutes for busy tenants; their own pool keeps summary and
+# pre-generated reports from queueing behind them
+full_report_executor = ProcessPoolExecutor(
+    max_workers=int(os.environ.get('FULL_REPORT_RENDER_WORKERS', '1')),
+    mp_context=multiprocessing.get_context("spawn")
+)
+# Full reports rendering or queued; further requests are turned away
+FULL_REPORT_MAX_PENDING = int(os.environ.get('FULL_REPORT_MAX_PENDING', '3'))
+full_report_pending = {"count": 0}
+# Rendered PDFs bounded by total size in bytes
+weekly_report_cache = TTLCache(
+    maxsize=int(os.environ.get('REPORT_CACHE_BYTES', str(64 * 1024 * 1024))),
+    ttl=7 * 86400,
+    getsizeof=len
+)
+
+def report_week(now: datetime) -> str:
+    iso_year, iso_week, _ = now.isocalendar()
+    return f"{iso_year}-W{iso_week:02d}"
+
+def weekly_report_cache_key(profile: dict, summary: dict, now: datetime) -> tuple:
+    """(user_id, ISO week, data version); the version changes whenever links or the profile change"""
+    profile_fields = f"{profile.get('company_name')}|{profile.get('industry')}|{profile.get('region')}"
+    data_version = f"{summary.get('total', 0)}:{summary.get('updated_at')}:{hashlib.sha1(profile_fields.encode('utf-8')).hexdigest()}"
+    return (profile["user_id"], report_week(now), data_version)
+
+async def weekly_severity_counts(week_query: dict) -> dict:
+    return {
+        bucket["_id"]: bucket["count"]
+        for bucket in await db.user_attacks.aggregate([
+            {"$match": week_query},
+            {"$group": {"_id": "$severity", "count": {"$sum": 1}}}
+        ]).to_list(None)
+    }
+
+async def build_weekly_report(profile: dict, now: datetime) -> bytes:
+    # Get threats from the past week
+    week_ago = now - timedelta(days=7)
+    week_query = {"user_id": profile["user_id"], "discovered_at": {"$gte": week_ago}}
+    
+    severity_counts = await weekly_severity_counts(week_query)
+    matched_attacks = await db.user_attacks.find(
+        week_query,
+        {"_id": 0, "name": 1, "severity": 1, "discovered_at": 1, "threat_actor": 1, "description": 1, "source_url": 1}
+    ).sort("discovered_at", -1).limit(REPORT_DETAIL_LIMIT).to_list(REPORT_DETAIL_LIMIT)
+    
+    # ReportLab is CPU-bound, render outside the event loop
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        report_executor,
+        render_weekly_report,
+        profile,
+        matched_attacks,
+        severity_counts,
+        sum(severity_counts.values()),
+        week_ago,
+        now
+    )
+
+async def stream_report_file(file_id):
+    grid_out = await report_files.open_download_stream(file_id)
+    while True:
+        chunk = await grid_out.readchunk()
+        if not chunk:
+            break
+        yield chunk
+
+async def stream_temp_file(path: str, chunk_size: int = 64 * 1024):
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                chunk = await asyncio.to_thread(f.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.remove(path)
+
+async def stream_full_weekly_report(profile: dict, now: datetime, headers: dict) -> StreamingResponse:
+    """Detail every threat of the week; rendered from a cursor in the full report pool to a temp file"""
+    if full_report_pending["count"] >= FULL_REPORT_MAX_PENDING:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many full reports are being generated, try again shortly",
+            headers={"Retry-After": "60"}
+        )
+    full_report_pending["count"] += 1
+    try:
+        week_ago = now - timedelta(days=7)
+        week_query = {"user_id": profile["user_id"], "discovered_at": {"$gte": week_ago}}
+        severity_counts = await weekly_severity_counts(week_query)
+        
+        loop = asyncio.get_running_loop()
+        path = await loop.run_in_executor(
+            full_report_executor,
+            render_full_weekly_report,
+            mongo_url,
+            os.environ['DB_NAME'],
+            profile,
+            week_query,
+            severity_counts,
+            sum(severity_counts.values()),
+            week_ago,
+            now
+        )
+    finally:
+        full_report_pending["count"] -= 1
+    return StreamingResponse(stream_temp_file(path), media_type="application/pdf", headers=headers)
+
 @api_router.get("/dashboard/weekly-report")
-async def generate_weekly_report(current_user: dict = Depends(get_current_user)):
+async def generate_weekly_report(
+    refresh: bool = False,
+    detail: str = "summary",
+    current_user: dict = Depends(get_token_user)
+):
     """Generate a PDF report of threats detected in the past week"""
+    now = datetime.now(timezone.utc)
+    filename = f"intellisecure_weekly_report_{now.strftime('%Y%m%d')}.pdf"
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    
+    if detail == "full":
+        profile = await db.profiles.find_one({"user_id": current_user["id"]}, {"_id": 0})
+        if not profile:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return await stream_full_weekly_report(profile, now, headers)
+    
+    summary = await get_tenant_summary(current_user["id"])
+    if not refresh:
+        # Serve this week's pre-generated report while no links have arrived since it was rendered
+        job = await db.report_jobs.find_one(
+            {"user_id": current_user["id"], "week": report_week(now), "status": "done"},
+            {"_id": 0, "file_id": 1, "rendered_at": 1}
+        )
+        if job and as_datetime(summary["updated_at"]) <= as_datetime(job["rendered_at"]):
+            return StreamingResponse(stream_report_file(job["file_id"]), media_type="application/pdf", headers=headers)
+    
     profile = await db.profiles.find_one({"user_id": current_user["id"]}, {"_id": 0})
     if not profile:
         raise HTTPException(status_code=404, detail="Profile not found")
     
-    # Get threats from the past week
-    week_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    week_ago_str = week_ago.isoformat()
-    
-    matched_attacks = await db.user_attacks.find({
-        "user_id": current_user["id"],
-        "discovered_at": {"$gte": week_ago_str}
-    }, {"_id": 0}).sort("discovered_at", -1).to_list(1000)
-    
-    # Create PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, rightMargin=72, leftMargin=72, topMargin=72, bottomMargin=18)
-    
-    # Container for PDF elements
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=24,
-        textColor=colors.HexColor('#667eea'),
-        spaceAfter=30,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'CustomHeading',
-        parent=styles['Heading2'],
-        fontSize=16,
-        textColor=colors.HexColor('#667eea'),
-        spaceAfter=12,
-        spaceBefore=12
-    )
-    
-    # Title
-    elements.append(Paragraph("Intellisecure Weekly Threat Report", title_style))
-    elements.append(Spacer(1, 12))
-    
-    # Report metadata
-    report_date = datetime.now(timezone.utc).strftime("%B %d, %Y")
-    elements.append(Paragraph(f"<b>Report Date:</b> {report_date}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Period:</b> {week_ago.strftime('%B %d, %Y')} - {datetime.now(timezone.utc).strftime('%B %d, %Y')}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Company:</b> {profile['company_name']}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Industry:</b> {profile['industry']}", styles['Normal']))
-    elements.append(Paragraph(f"<b>Region:</b> {profile['region']}", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Executive Summary
-    elements.append(Paragraph("Executive Summary", heading_style))
-    
-    critical_count = len([a for a in matched_attacks if a.get('severity') == 'Critical'])
-    high_count = len([a for a in matched_attacks if a.get('severity') == 'High'])
-    medium_count = len([a for a in matched_attacks if a.get('severity') == 'Medium'])
-    low_count = len([a for a in matched_attacks if a.get('severity') == 'Low'])
-    
-    summary_data = [
-        ['Severity Level', 'Count'],
-        ['Critical', str(critical_count)],
-        ['High', str(high_count)],
-        ['Medium', str(medium_count)],
-        ['Low', str(low_count)],
-        ['Total Threats', str(len(matched_attacks))]
-    ]
-    
-    summary_table = Table(summary_data, colWidths=[3*inch, 2*inch])
-    summary_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#667eea')),
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-        ('GRID', (0, 0), (-1, -1), 1, colors.black),
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.lightgrey])
-    ]))
-    
-    elements.append(summary_table)
-    elements.append(Spacer(1, 20))
-    
-    # Detailed Threats
-    if matched_attacks:
-        elements.append(Paragraph("Detailed Threat Analysis", heading_style))
-        elements.append(Spacer(1, 12))
-        
-        for i, attack in enumerate(matched_attacks[:20], 1):  # Limit to 20 threats
-            elements.append(Paragraph(f"<b>{i}. {attack['name']}</b>", styles['Heading3']))
-            elements.append(Paragraph(f"<b>Severity:</b> {attack.get('severity', 'Unknown')}", styles['Normal']))
-            elements.append(Paragraph(f"<b>Detected:</b> {datetime.fromisoformat(attack['discovered_at']).strftime('%B %d, %Y %H:%M UTC')}", styles['Normal']))
-            
-            if attack.get('threat_actor'):
-                elements.append(Paragraph(f"<b>Threat Actor:</b> {attack['threat_actor']}", styles['Normal']))
-            
-            elements.append(Paragraph(f"<b>Description:</b> {attack.get('description', 'No description available')}", styles['Normal']))
-            elements.append(Paragraph(f"<b>Source:</b> <link href='{attack.get('source_url', '')}'>{attack.get('source_url', 'N/A')}</link>", styles['Normal']))
-            elements.append(Spacer(1, 12))
-            
-            if i % 5 == 0 and i < len(matched_attacks):
-                elements.append(PageBreak())
-    else:
-        elements.append(Paragraph("No threats detected in the past week.", styles['Normal']))
-        elements.append(Spacer(1, 12))
-        elements.append(Paragraph("Your security posture remains strong. Continue monitoring for emerging threats.", styles['Normal']))
-    
-    # Recommendations
-    elements.append(PageBreak())
-    elements.append(Paragraph("Recommendations", heading_style))
-    
-    if critical_count > 0 or high_count > 0:
-        elements.append(Paragraph("• <b>Immediate Action Required:</b> Review and address all Critical and High severity threats within 24 hours.", styles['Normal']))
-        elements.append(Spacer(1, 6))
-    
-    elements.append(Paragraph("• <b>Deploy Security Rules:</b> Implement the generated Yara and Sigma rules in your security infrastructure.", styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph("• <b>Update Security Policies:</b> Review and update incident response procedures based on detected threat patterns.", styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph("• <b>Team Training:</b> Conduct security awareness training for your team on recent threat vectors.", styles['Normal']))
-    elements.append(Spacer(1, 6))
-    elements.append(Paragraph("• <b>Continuous Monitoring:</b> Ensure 24/7 monitoring is in place for real-time threat detection.", styles['Normal']))
-    elements.append(Spacer(1, 20))
-    
-    # Footer
-    elements.append(Paragraph("___", styles['Normal']))
-    elements.append(Paragraph(f"This report was generated by Intellisecure on {report_date}", styles['Normal']))
-    elements.append(Paragraph("For more information, visit your Intellisecure dashboard.", styles['Normal']))
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
-    filename = f"intellisecure_weekly_report_{datetime.now(timezone.utc).strftime('%Y%m%d')}.pdf"
+    cache_key = weekly_report_cache_key(profile, summary, now)
+    pdf = weekly_report_cache.get(cache_key)
+    if pdf is None:
+        pdf = await build_weekly_report(profile, now)
+        weekly_report_cache[cache_key] = pdf
     
     return StreamingResponse(
-        buffer,
+        io.BytesIO(pdf),
         media_type="application/pdf",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
+        headers=headers
     )
 
 # ==================== INSIGHTS ENDPOINT ====================
@@ -612,64 +767,73 @@ async def get_insights():
     insights = await db.threat_intel.find({}, {"_id": 0}).sort("published_at", -1).limit(20).to_list(20)
     return insights
 
-@api_router.get("/dashboard/threat-hunt")
-async def get_threat_hunt_queries(current_user: dict = Depends(get_current_user)):
-    """Generate threat hunting queries using admin-curated IOCs"""
+# Threat hunt queries are generated in the background per IOC set and served from threat_hunt_queries
+THREAT_HUNT_QUERY_HISTORY = 10
+threat_hunt_refresh = {"task": None, "dirty": False}
+
+NO_IOC_QUERIES = {
+    "splunk": {
+        "query": "# No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
+        "description": "No IOCs available for threat hunting"
+    },
+    "elastic": {
+        "query": "# No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
+        "description": "No IOCs available for threat hunting"
+    },
+    "qradar": {
+        "query": "-- No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
+        "description": "No IOCs available for threat hunting"
+    }
+}
+
+IOC_CATEGORIES = {"ip": "ips", "domain": "domains", "hash": "hashes", "url": "urls", "email": "emails"}
+
+def categorize_iocs(iocs: List[dict]) -> dict:
+    all_iocs = {category: [] for category in IOC_CATEGORIES.values()}
+    for ioc in iocs:
+        category = IOC_CATEGORIES.get(ioc.get("type"))
+        if category:
+            all_iocs[category].append(ioc["value"])
+    return all_iocs
+
+async def count_iocs_by_type() -> dict:
+    """Per-type IOC counts from a single $group over the whole collection"""
+    stats = {"total": 0, **{category: 0 for category in IOC_CATEGORIES.values()}}
+    async for row in db.threat_hunt_iocs.aggregate([{"$group": {"_id": "$type", "count": {"$sum": 1}}}]):
+        stats["total"] += row["count"]
+        category = IOC_CATEGORIES.get(row["_id"])
+        if category:
+            stats[category] = row["count"]
+    return stats
+
+def threat_hunt_ioc_stats(all_iocs: dict, ioc_count: int) -> dict:
+    return {
+        "total_iocs": ioc_count,
+        "ips": len(all_iocs["ips"]),
+        "domains": len(all_iocs["domains"]),
+        "hashes": len(all_iocs["hashes"]),
+        "urls": len(all_iocs["urls"]),
+        "emails": len(all_iocs["emails"])
+    }
+
+def ioc_set_digest(iocs: List[dict]) -> str:
+    values = sorted(f"{ioc.get('type')}:{ioc.get('value')}" for ioc in iocs)
+    return hashlib.sha256("\n".join(values).encode('utf-8')).hexdigest()
+
+async def generate_siem_queries(all_iocs: dict, ioc_count: int) -> Optional[dict]:
+    """Ask Gemini for SIEM queries covering the IOC set; None when generation fails"""
+    queries = None
     try:
-        # Get all admin-curated IOCs for threat hunting
-        iocs = await db.threat_hunt_iocs.find({}, {"_id": 0}).to_list(1000)
-        
-        if not iocs:
-            return {
-                "queries": {
-                    "splunk": {
-                        "query": "# No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
-                        "description": "No IOCs available for threat hunting"
-                    },
-                    "elastic": {
-                        "query": "# No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
-                        "description": "No IOCs available for threat hunting"
-                    },
-                    "qradar": {
-                        "query": "-- No IOCs configured yet. Please contact your administrator to add threat hunting IOCs.",
-                        "description": "No IOCs available for threat hunting"
-                    }
-                },
-                "ioc_stats": {
-                    "total_iocs": 0,
-                    "ips": 0,
-                    "domains": 0,
-                    "hashes": 0,
-                    "urls": 0,
-                    "emails": 0
-                },
-                "last_updated": datetime.now(timezone.utc).isoformat()
-            }
-        
-        # Categorize IOCs
-        all_iocs = {
-            "ips": [ioc["value"] for ioc in iocs if ioc.get("type") == "ip"],
-            "domains": [ioc["value"] for ioc in iocs if ioc.get("type") == "domain"],
-            "hashes": [ioc["value"] for ioc in iocs if ioc.get("type") == "hash"],
-            "urls": [ioc["value"] for ioc in iocs if ioc.get("type") == "url"],
-            "emails": [ioc["value"] for ioc in iocs if ioc.get("type") == "email"]
-        }
-        
-        ioc_count = len(iocs)
-        
-        # Try to generate SIEM queries using Gemini
-        queries = None
-        try:
-            gemini_key = os.environ['GEMINI_API_KEY']
-            chat = LlmChat(
-                api_key=gemini_key,
-                session_id="threat_hunt_queries",
-                system_message="""You are a cybersecurity SIEM expert. Generate threat hunting queries for different SIEM platforms.
+        gemini_key = os.environ['GEMINI_API_KEY']
+        chat = LlmChat(
+            api_key=gemini_key,
+            session_id="threat_hunt_queries",
+            system_message="""You are a cybersecurity SIEM expert. Generate threat hunting queries for different SIEM platforms.
 Create optimized, production-ready queries that security analysts can use immediately.
 Return ONLY valid JSON without any markdown formatting."""
-            ).with_model("gemini", "gemini-2.5-flash")
-            
-            ioc_summary = f"""
+        ).with_model("gemini", "gemini-2.5-flash")
+        
+        ioc_summary = f"""
 Total IOCs: {ioc_count}
 IPs ({len(all_iocs['ips'])}): {all_iocs['ips'][:10]}
 Domains ({len(all_iocs['domains'])}): {all_iocs['domains'][:10]}
@@ -677,8 +841,8 @@ Hashes ({len(all_iocs['hashes'])}): {all_iocs['hashes'][:10]}
 URLs ({len(all_iocs['urls'])}): {all_iocs['urls'][:5]}
 Emails ({len(all_iocs['emails'])}): {all_iocs['emails'][:5]}
 """
-            
-            prompt = f"""Generate threat hunting queries for these admin-curated IOCs:
+        
+        prompt = f"""Generate threat hunting queries for these admin-curated IOCs:
 
 {ioc_summary}
 
@@ -708,89 +872,126 @@ Return as JSON:
     "description": "what this query does"
   }}
 }}"""
-            
-            message = UserMessage(text=prompt)
-            response = await chat.send_message(message)
-            
-            # Parse JSON response
-            json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL)
-            if json_match:
-                queries = json.loads(json_match.group())
-        except Exception as gemini_error:
-            logging.warning(f"Gemini query generation failed, using fallback: {gemini_error}")
         
-        # Use fallback if Gemini failed or didn't return valid queries
+        message = UserMessage(text=prompt)
+        response = await chat.send_message(message)
+        
+        # Parse JSON response
+        json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL)
+        if json_match:
+            queries = json.loads(json_match.group())
+    except Exception as gemini_error:
+        logging.warning(f"Gemini query generation failed, using fallback: {gemini_error}")
+    return queries
+
+async def refresh_threat_hunt_queries():
+    """Regenerate queries for the current IOC set unless that set was already generated"""
+    iocs = await db.threat_hunt_iocs.find({}, {"_id": 0, "type": 1, "value": 1}).to_list(None)
+    digest = ioc_set_digest(iocs)
+    now = datetime.now(timezone.utc)
+    
+    # Template fallbacks are retried, generated queries are reused as-is
+    result = await db.threat_hunt_queries.update_one(
+        {"digest": digest, "source": {"$ne": "fallback"}},
+        {"$set": {"generated_at": now}}
+    )
+    if result.matched_count:
+        return
+    
+    all_iocs = categorize_iocs(iocs)
+    if not iocs:
+        queries, source = NO_IOC_QUERIES, "empty"
+    else:
+        queries, source = await generate_siem_queries(all_iocs, len(iocs)), "gemini"
         if not queries:
-            queries = generate_fallback_queries(all_iocs)
+            # Use fallback if Gemini failed or didn't return valid queries
+            queries, source = generate_fallback_queries(all_iocs), "fallback"
+    
+    await db.threat_hunt_queries.update_one(
+        {"digest": digest},
+        {"$set": {
+            "queries": queries,
+            "ioc_stats": threat_hunt_ioc_stats(all_iocs, len(iocs)),
+            "source": source,
+            "generated_at": now
+        }},
+        upsert=True
+    )
+    
+    stale = await db.threat_hunt_queries.find({}, {"_id": 1}).sort("generated_at", -1).skip(THREAT_HUNT_QUERY_HISTORY).to_list(None)
+    if stale:
+        await db.threat_hunt_queries.delete_many({"_id": {"$in": [doc["_id"] for doc in stale]}})
+
+async def run_threat_hunt_refresh():
+    while True:
+        threat_hunt_refresh["dirty"] = False
+        try:
+            await refresh_threat_hunt_queries()
+        except Exception as e:
+            logging.error(f"Error refreshing threat hunt queries: {e}")
+        # IOC changes during a refresh trigger one more pass
+        if not threat_hunt_refresh["dirty"]:
+            break
+
+def schedule_threat_hunt_refresh():
+    task = threat_hunt_refresh["task"]
+    if task and not task.done():
+        threat_hunt_refresh["dirty"] = True
+        return
+    threat_hunt_refresh["task"] = asyncio.create_task(run_threat_hunt_refresh())
+
+@api_router.get("/dashboard/threat-hunt")
+async def get_threat_hunt_queries(current_user: dict = Depends(get_token_user)):
+    """Serve threat hunting queries generated for the current admin-curated IOC set"""
+    try:
+        cached = await db.threat_hunt_queries.find_one({}, {"_id": 0}, sort=[("generated_at", -1)])
+        if cached:
+            return {
+                "queries": cached["queries"],
+                "ioc_stats": cached["ioc_stats"],
+                "last_updated": cached["generated_at"]
+            }
         
+        # Nothing generated yet: answer with template queries while the refresh runs
+        schedule_threat_hunt_refresh()
+        iocs = await db.threat_hunt_iocs.find({}, {"_id": 0, "type": 1, "value": 1}).to_list(None)
+        all_iocs = categorize_iocs(iocs)
         return {
-            "queries": queries,
-            "ioc_stats": {
-                "total_iocs": ioc_count,
-                "ips": len(all_iocs["ips"]),
-                "domains": len(all_iocs["domains"]),
-                "hashes": len(all_iocs["hashes"]),
-                "urls": len(all_iocs["urls"]),
-                "emails": len(all_iocs["emails"])
-            },
-            "last_updated": datetime.now(timezone.utc).isoformat()
+            "queries": generate_fallback_queries(all_iocs) if iocs else NO_IOC_QUERIES,
+            "ioc_stats": threat_hunt_ioc_stats(all_iocs, len(iocs)),
+            "last_updated": datetime.now(timezone.utc).isoformat(),
+            "note": "Using basic queries while tailored queries are generated"
         }
         
     except Exception as e:
         logging.error(f"Error generating threat hunt queries: {e}")
-        # Always return fallback queries instead of error
-        try:
-            iocs = await db.threat_hunt_iocs.find({}, {"_id": 0}).to_list(1000)
-            all_iocs = {
-                "ips": [ioc["value"] for ioc in iocs if ioc.get("type") == "ip"],
-                "domains": [ioc["value"] for ioc in iocs if ioc.get("type") == "domain"],
-                "hashes": [ioc["value"] for ioc in iocs if ioc.get("type") == "hash"],
-                "urls": [ioc["value"] for ioc in iocs if ioc.get("type") == "url"],
-                "emails": [ioc["value"] for ioc in iocs if ioc.get("type") == "email"]
-            }
-            queries = generate_fallback_queries(all_iocs)
-            
-            return {
-                "queries": queries,
-                "ioc_stats": {
-                    "total_iocs": len(iocs),
-                    "ips": len(all_iocs["ips"]),
-                    "domains": len(all_iocs["domains"]),
-                    "hashes": len(all_iocs["hashes"]),
-                    "urls": len(all_iocs["urls"]),
-                    "emails": len(all_iocs["emails"])
-                },
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-                "note": "Using basic queries due to service limitations"
-            }
-        except:
-            # Final fallback
-            return {
-                "queries": {
-                    "splunk": {
-                        "query": "index=* earliest=-7d | stats count by src_ip, dest_ip, url",
-                        "description": "Basic network activity search for last 7 days"
-                    },
-                    "elastic": {
-                        "query": "event.category:network AND @timestamp >= now-7d",
-                        "description": "Network events from last 7 days"
-                    },
-                    "qradar": {
-                        "query": "SELECT * FROM events LAST 7 DAYS",
-                        "description": "All events from last 7 days"
-                    }
+        # Final fallback
+        return {
+            "queries": {
+                "splunk": {
+                    "query": "index=* earliest=-7d | stats count by src_ip, dest_ip, url",
+                    "description": "Basic network activity search for last 7 days"
                 },
-                "ioc_stats": {
-                    "total_iocs": 0,
-                    "ips": 0,
-                    "domains": 0,
-                    "hashes": 0,
-                    "urls": 0,
-                    "emails": 0
+                "elastic": {
+                    "query": "event.category:network AND @timestamp >= now-7d",
+                    "description": "Network events from last 7 days"
                 },
-                "last_updated": datetime.now(timezone.utc).isoformat(),
-                "error": "Service temporarily unavailable"
-            }
+                "qradar": {
+                    "query": "SELECT * FROM events LAST 7 DAYS",
+                    "description": "All events from last 7 days"
+                }
+            },
+            "ioc_stats": {
+                "total_iocs": 0,
+                "ips": 0,
+                "domains": 0,
+                "hashes": 0,
+                "urls": 0,
+                "emails": 0
+            },
+            "last_updated": datetime.now(timezone.utc).isoformat(),
+            "error": "Service temporarily unavailable"
+        }
 
 def generate_fallback_queries(all_iocs: dict) -> dict:
     """Generate basic fallback queries when Gemini is unavailable"""
@@ -864,6 +1065,28 @@ async def get_all_companies(admin: dict = Depends(verify_admin)):
 async def get_resources(admin: dict = Depends(verify_admin)):
     return {"sources": THREAT_SOURCES}
 
+@api_router.get("/admin/resources/health")
+async def get_resources_health(admin: dict = Depends(verify_admin)):
+    """Per-source scheduling and health stats from the feed scheduler"""
+    now = time.time()
+    sources = []
+    for source in THREAT_SOURCES:
+        health = dict(get_source_health(source))
+        health["next_run_in_seconds"] = max(0, round(health.pop("next_run") - now))
+        sources.append(health)
+    return {"sources": sources}
+
+@api_router.get("/admin/llm-cache")
+async def get_llm_cache_stats(admin: dict = Depends(verify_admin)):
+    """Hit/miss counters for the LLM analysis cache since startup"""
+    lookups = llm_cache_stats["hits"] + llm_cache_stats["misses"]
+    return {
+        **llm_cache_stats,
+        "hit_rate": round(llm_cache_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries": await db.llm_analysis_cache.estimated_document_count(),
+        "prompt_version": ANALYSIS_PROMPT_VERSION
+    }
+
 @api_router.post("/admin/resources")
 async def add_resource(resource_url: dict, admin: dict = Depends(verify_admin)):
     url = resource_url.get("url")
@@ -880,10 +1103,26 @@ async def delete_resource(resource_url: dict, admin: dict = Depends(verify_admin
         return {"message": "Resource removed successfully", "sources": THREAT_SOURCES}
     raise HTTPException(status_code=400, detail="URL not found")
 
+@api_router.post("/admin/tenant-summaries/rebuild")
+async def rebuild_tenant_summaries(user_id: Optional[str] = None, admin: dict = Depends(verify_admin)):
+    """Rebuild dashboard summaries from user_attacks for one tenant or all tenants"""
+    if user_id:
+        user_ids = [user_id]
+    else:
+        user_ids = await db.profiles.distinct("user_id")
+    for uid in user_ids:
+        await rebuild_tenant_summary(uid)
+    return {"message": f"Rebuilt {len(user_ids)} tenant summaries"}
+
 @api_router.get("/admin/attacks")
-async def get_all_attacks(admin: dict = Depends(verify_admin)):
-    attacks = await db.attacks.find({}, {"_id": 0}).sort("discovered_at", -1).limit(100).to_list(100)
-    return attacks
+async def get_all_attacks(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    admin: dict = Depends(verify_admin)
+):
+    return await paginate(db.attacks, {}, build_projection(fields), limit, cursor, response)
 
 # ==================== THREAT HUNT IOC MANAGEMENT ====================
 
@@ -894,34 +1133,146 @@ class ThreatHuntIOC(BaseModel):
     value: str
     description: str = ""
     source: str = ""
+    hash_type: Optional[str] = None  # md5, sha1, sha256, sha512 for hash IOCs
     added_by: str = "admin"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+IOC_IMPORT_BATCH_SIZE = int(os.environ.get('IOC_IMPORT_BATCH_SIZE', '1000'))
+IOC_IMPORT_FORMATS = ("csv", "ndjson", "stix")
+IOC_CSV_COLUMNS = ["value", "type", "description", "source"]
+IOC_IMPORT_HISTORY = 20
+IOC_PAGE_SIZE = 100
+
+class IOCImporter:
+    """Normalizes and dedups IOCs, writing them in insert_many batches with running counts"""
+
+    def __init__(self, source: str = "", import_id: Optional[str] = None):
+        self.source = source
+        # Progress of tracked imports is recorded on their ioc_imports document
+        self.import_id = import_id
+        self.batch: List[dict] = []
+        self.seen = set()
+        self.processed = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+
+    def add(self, raw) -> bool:
+        """Queue one raw IOC; returns True once the batch is ready to flush"""
+        self.processed += 1
+        value = raw.get("value") if isinstance(raw, dict) else None
+        if not isinstance(value, str):
+            self.invalid += 1
+            return False
+        ioc_type = str(raw.get("type") or "").strip().lower() or detect_ioc_type(value)
+        normalized = normalize_ioc(ioc_type, value)
+        if not normalized:
+            self.invalid += 1
+            return False
+        if (ioc_type, normalized) in self.seen:
+            self.duplicates += 1
+            return False
+        self.seen.add((ioc_type, normalized))
+        ioc = ThreatHuntIOC(
+            type=ioc_type,
+            value=normalized,
+            description=str(raw.get("description") or ""),
+            source=str(raw.get("source") or self.source),
+            hash_type=hash_type(normalized) if ioc_type == "hash" else None
+        )
+        self.batch.append(ioc.model_dump())
+        return len(self.batch) >= IOC_IMPORT_BATCH_SIZE
+
+    async def flush(self):
+        batch, self.batch = self.batch, []
+        inserted = await insert_many_ignoring_duplicates(db.threat_hunt_iocs, batch)
+        # Rejected by the unique (type, value) index: already stored
+        self.inserted += inserted
+        self.duplicates += len(batch) - inserted
+        await self.record({"status": "running"})
+
+    async def record(self, fields: dict):
+        if self.import_id:
+            await db.ioc_imports.update_one(
+                {"id": self.import_id},
+                {"$set": {**fields, **self.progress(), "updated_at": datetime.now(timezone.utc)}}
+            )
+
+    def progress(self) -> dict:
+        return {
+            "processed": self.processed,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid
+        }
+
+    async def finish(self, error: Optional[str] = None):
+        await self.flush()
+        if self.inserted:
+            await load_ioc_matcher()
+            schedule_threat_hunt_refresh()
+        await self.record({"status": "failed" if error else "done", "error": error})
+
+async def normalize_stored_iocs():
+    """Normalize stored IOC values and drop duplicates so the unique (type, value) index can be built"""
+    seen = set()
+    duplicates = []
+    operations = []
+    async for doc in db.threat_hunt_iocs.find({}, {"_id": 1, "type": 1, "value": 1}).sort("created_at", 1):
+        ioc_type, value = doc.get("type"), doc.get("value")
+        normalized = normalize_ioc(ioc_type, value) or value
+        if (ioc_type, normalized) in seen:
+            duplicates.append(doc["_id"])
+            continue
+        seen.add((ioc_type, normalized))
+        if normalized != value:
+            update = {"value": normalized}
+            if ioc_type == "hash":
+                update["hash_type"] = hash_type(normalized)
+            operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": update}))
+    
+    # Oldest copy is kept; duplicates go first so normalized values never collide
+    for i in range(0, len(duplicates), IOC_IMPORT_BATCH_SIZE):
+        await db.threat_hunt_iocs.delete_many({"_id": {"$in": duplicates[i:i + IOC_IMPORT_BATCH_SIZE]}})
+    for i in range(0, len(operations), IOC_IMPORT_BATCH_SIZE):
+        await db.threat_hunt_iocs.bulk_write(operations[i:i + IOC_IMPORT_BATCH_SIZE], ordered=False)
+    if duplicates or operations:
+        logging.info(f"Threat hunt IOCs: removed {len(duplicates)} duplicates, normalized {len(operations)} values")
+
 @api_router.get("/admin/threat-hunt-iocs")
-async def get_threat_hunt_iocs(admin: dict = Depends(verify_admin)):
-    """Get all curated IOCs for threat hunting"""
-    iocs = await db.threat_hunt_iocs.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    
-    # Get statistics
-    stats = {
-        "total": len(iocs),
-        "ips": len([ioc for ioc in iocs if ioc.get("type") == "ip"]),
-        "domains": len([ioc for ioc in iocs if ioc.get("type") == "domain"]),
-        "hashes": len([ioc for ioc in iocs if ioc.get("type") == "hash"]),
-        "urls": len([ioc for ioc in iocs if ioc.get("type") == "url"]),
-        "emails": len([ioc for ioc in iocs if ioc.get("type") == "email"])
-    }
+async def get_threat_hunt_iocs(
+    limit: int = Query(IOC_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    skip: int = Query(0, ge=0),
+    admin: dict = Depends(verify_admin)
+):
+    """Get one page of curated IOCs, newest first; stats always cover the whole collection"""
+    # Bulk imports share created_at values, id keeps the page order stable
+    cursor = db.threat_hunt_iocs.find({}, {"_id": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).skip(skip).limit(limit + 1)
+    iocs, stats = await asyncio.gather(cursor.to_list(limit + 1), count_iocs_by_type())
     
-    return {"iocs": iocs, "stats": stats}
+    has_more = len(iocs) > limit
+    return {"iocs": iocs[:limit], "stats": stats, "next_skip": skip + limit if has_more else None}
 
 @api_router.post("/admin/threat-hunt-iocs")
 async def add_threat_hunt_ioc(ioc: ThreatHuntIOC, admin: dict = Depends(verify_admin)):
     """Add a new IOC for threat hunting"""
+    value = normalize_ioc(ioc.type, ioc.value)
+    if not value:
+        raise HTTPException(status_code=400, detail=f"Invalid {ioc.type} IOC value")
+    ioc.value = value
+    if ioc.type == "hash":
+        ioc.hash_type = hash_type(value)
     ioc_dict = ioc.model_dump()
-    ioc_dict['created_at'] = ioc_dict['created_at'].isoformat()
     
     # Store in database
-    await db.threat_hunt_iocs.insert_one(ioc_dict.copy())
+    try:
+        await db.threat_hunt_iocs.insert_one(ioc_dict.copy())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="IOC already exists")
+    ioc_matcher_state["matcher"].add(ioc_dict['type'], ioc_dict['value'])
+    schedule_threat_hunt_refresh()
     
     # Return without MongoDB _id
     return {"message": "IOC added successfully", "ioc": {
@@ -930,36 +1281,108 @@ async def add_threat_hunt_ioc(ioc: ThreatHuntIOC, admin: dict = Depends(verify_a
         "value": ioc_dict['value'],
         "description": ioc_dict.get('description', ''),
         "source": ioc_dict.get('source', ''),
+        "hash_type": ioc_dict.get('hash_type'),
         "created_at": ioc_dict['created_at']
     }}
 
 @api_router.delete("/admin/threat-hunt-iocs/{ioc_id}")
 async def delete_threat_hunt_ioc(ioc_id: str, admin: dict = Depends(verify_admin)):
     """Delete an IOC from threat hunting collection"""
-    result = await db.threat_hunt_iocs.delete_one({"id": ioc_id})
-    if result.deleted_count == 0:
+    deleted = await db.threat_hunt_iocs.find_one_and_delete({"id": ioc_id}, {"_id": 0, "type": 1, "value": 1})
+    if not deleted:
         raise HTTPException(status_code=404, detail="IOC not found")
+    ioc_matcher_state["matcher"].remove(deleted.get("type"), deleted.get("value"))
+    schedule_threat_hunt_refresh()
     return {"message": "IOC deleted successfully"}
 
 @api_router.post("/admin/threat-hunt-iocs/bulk")
 async def add_bulk_threat_hunt_iocs(iocs_data: dict, admin: dict = Depends(verify_admin)):
     """Add multiple IOCs at once"""
-    iocs_list = iocs_data.get("iocs", [])
-    added_count = 0
-    
-    for ioc_data in iocs_list:
-        ioc = ThreatHuntIOC(
-            type=ioc_data.get("type"),
-            value=ioc_data.get("value"),
-            description=ioc_data.get("description", ""),
-            source=ioc_data.get("source", "")
-        )
-        ioc_dict = ioc.model_dump()
-        ioc_dict['created_at'] = ioc_dict['created_at'].isoformat()
-        await db.threat_hunt_iocs.insert_one(ioc_dict)
-        added_count += 1
-    
-    return {"message": f"{added_count} IOCs added successfully"}
+    importer = IOCImporter()
+    for ioc_data in iocs_data.get("iocs", []):
+        if importer.add(ioc_data):
+            await importer.flush()
+    await importer.finish()
+    return {"message": f"{importer.inserted} IOCs added successfully", **importer.progress()}
+
+@api_router.post("/admin/threat-hunt-iocs/import")
+async def import_threat_hunt_iocs(
+    request: Request,
+    input_format: str = Query("ndjson", alias="format"),
+    source: str = "",
+    admin: dict = Depends(verify_admin)
+):
+    """Import a streamed CSV, NDJSON or STIX bundle of IOCs; progress is kept on the ioc_imports document"""
+    if input_format not in IOC_IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(IOC_IMPORT_FORMATS)}")
+    import_id = str(uuid.uuid4())
+    await db.ioc_imports.insert_one({
+        "id": import_id,
+        "format": input_format,
+        "source": source,
+        "status": "running",
+        "started_at": datetime.now(timezone.utc)
+    })
+    importer = IOCImporter(source, import_id)
+
+    def parse_lines(lines: List[bytes], columns: List[str]):
+        text = [raw.decode('utf-8', errors='replace').strip() for raw in lines]
+        text = [line for line in text if line and not line.startswith('#')]
+        if input_format == "ndjson":
+            for line in text:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    yield None
+            return
+        for row in csv.reader(text):
+            yield dict(zip(columns, (field.strip() for field in row)))
+
+    # The body is consumed in the handler, never from a StreamingResponse generator,
+    # whose disconnect listener would swallow unread body chunks
+    try:
+        if input_format == "stix":
+            # A bundle is one JSON document, so it is parsed once fully received
+            try:
+                bundle = json.loads(await request.body())
+            except ValueError:
+                await importer.finish(error="Invalid STIX bundle")
+                raise HTTPException(status_code=400, detail="Invalid STIX bundle")
+            for raw in stix_indicators(bundle):
+                if importer.add(raw):
+                    await importer.flush()
+        else:
+            columns = None if input_format == "csv" else IOC_CSV_COLUMNS
+            async for lines in body_line_batches(request):
+                if columns is None:
+                    # Header row when it names a value column, otherwise positional columns
+                    header = next(csv.reader([lines[0].decode('utf-8', errors='replace')]), [])
+                    header = [name.strip().lower() for name in header]
+                    columns = header if "value" in header else IOC_CSV_COLUMNS
+                    if columns is header:
+                        lines = lines[1:]
+                for raw in parse_lines(lines, columns):
+                    if importer.add(raw):
+                        await importer.flush()
+    except ClientDisconnect:
+        # Whatever arrived before the disconnect is kept
+        await importer.finish(error="Client disconnected before the upload completed")
+        raise HTTPException(status_code=400, detail="Upload was not completed")
+    
+    await importer.finish()
+    return {"id": import_id, "status": "done", **importer.progress()}
+
+@api_router.get("/admin/threat-hunt-iocs/imports")
+async def get_threat_hunt_ioc_imports(admin: dict = Depends(verify_admin)):
+    """Recent IOC imports with their progress counts"""
+    return await db.ioc_imports.find({}, {"_id": 0}).sort("started_at", -1).to_list(IOC_IMPORT_HISTORY)
+
+@api_router.get("/admin/threat-hunt-iocs/imports/{import_id}")
+async def get_threat_hunt_ioc_import(import_id: str, admin: dict = Depends(verify_admin)):
+    ioc_import = await db.ioc_imports.find_one({"id": import_id}, {"_id": 0})
+    if not ioc_import:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return ioc_import
 
 @api_router.put("/admin/attack/{attack_id}/rules")
 async def update_attack_rules(attack_id: str, rules_data: dict, admin: dict = Depends(verify_admin)):
@@ -1002,10 +1425,13 @@ async def update_attack_rules(attack_id: str, rules_data: dict, admin: dict = De
         any of them
 }}"""
     
+    # Edits apply to the current template version, created first for legacy attacks
+    await ensure_attack_rules([attack])
+    
     # Update Yara rule in database
     await db.yara_rules.update_many(
-        {"attack_id": attack_id},
-        {"$set": {"rule_content": yara_rule_content, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"attack_id": attack_id, "template_version": RULE_TEMPLATE_VERSION},
+        {"$set": {"rule_content": yara_rule_content, "updated_at": datetime.now(timezone.utc)}}
     )
     
     # Generate enhanced Sigma rule
@@ -1055,8 +1481,8 @@ level: """
     
     # Update Sigma rule in database
     await db.sigma_rules.update_many(
-        {"attack_id": attack_id},
-        {"$set": {"rule_content": sigma_rule_content, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"attack_id": attack_id, "template_version": RULE_TEMPLATE_VERSION},
+        {"$set": {"rule_content": sigma_rule_content, "updated_at": datetime.now(timezone.utc)}}
     )
     
     return {
@@ -1065,6 +1491,111 @@ level: """
         "sigma_rule": sigma_rule_content
     }
 
+# ==================== IOC MATCHING ====================
+
+# Changes made through other workers are picked up by a periodic full rebuild
+IOC_MATCHER_MAX_AGE_SECONDS = int(os.environ.get('IOC_MATCHER_MAX_AGE_SECONDS', '300'))
+IOC_SCAN_MAX_LINE_BYTES = 1024 * 1024
+# Scan results beyond this size are spooled to disk until the response is sent
+IOC_SCAN_SPOOL_BYTES = 8 * 1024 * 1024
+
+ioc_matcher_state = {"matcher": IOCMatcher(), "loaded_at": 0.0}
+ioc_matcher_lock = asyncio.Lock()
+
+async def load_ioc_matcher():
+    """Rebuild the in-memory IOC matcher from threat_hunt_iocs"""
+    async with ioc_matcher_lock:
+        cursor = db.threat_hunt_iocs.find({}, {"_id": 0, "type": 1, "value": 1})
+        ioc_matcher_state["matcher"] = build_matcher([ioc async for ioc in cursor])
+        ioc_matcher_state["loaded_at"] = time.monotonic()
+    logging.info(f"IOC matcher loaded with {len(ioc_matcher_state['matcher'])} indicators")
+
+async def current_ioc_matcher() -> IOCMatcher:
+    if time.monotonic() - ioc_matcher_state["loaded_at"] > IOC_MATCHER_MAX_AGE_SECONDS:
+        await load_ioc_matcher()
+    return ioc_matcher_state["matcher"]
+
+async def body_line_batches(request: Request):
+    """Yield the complete lines of a streamed request body, one list per received chunk"""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        lines = buffer.split(b"\n")
+        buffer = lines.pop()
+        if len(buffer) > IOC_SCAN_MAX_LINE_BYTES:
+            lines.append(buffer)
+            buffer = b""
+        if lines:
+            yield lines
+    if buffer:
+        yield [buffer]
+
+async def stream_spooled_file(spool, chunk_size: int = 64 * 1024):
+    try:
+        while True:
+            chunk = await asyncio.to_thread(spool.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        spool.close()
+
+def record_text(record) -> str:
+    """Join every string value of a decoded NDJSON record for scanning"""
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        return " ".join(record_text(value) for value in record.values())
+    if isinstance(record, list):
+        return " ".join(record_text(value) for value in record)
+    return ""
+
+@api_router.post("/dashboard/threat-hunt/scan")
+async def scan_logs_for_iocs(
+    request: Request,
+    input_format: str = Query("text", alias="format"),
+    current_user: dict = Depends(get_token_user)
+):
+    """Scan log lines (plain text or NDJSON) streamed in the request body and return IOC hits as NDJSON"""
+    if input_format not in ("text", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be 'text' or 'ndjson'")
+    matcher = await current_ioc_matcher()
+
+    def scan_line(line_number: int, raw: bytes) -> Optional[str]:
+        line = raw.decode('utf-8', errors='replace').strip()
+        if not line:
+            return None
+        text = line
+        if input_format == "ndjson":
+            try:
+                text = record_text(json.loads(line))
+            except ValueError:
+                pass
+        matches = matcher.match_text(text)
+        if not matches:
+            return None
+        return json.dumps({"line": line_number, "matches": matches}) + "\n"
+
+    # The body is consumed before the response starts: StreamingResponse listens for
+    # disconnects on the same receive channel and would swallow unread body chunks
+    results = tempfile.SpooledTemporaryFile(max_size=IOC_SCAN_SPOOL_BYTES)
+    line_number = 0
+    matched_lines = 0
+    async for lines in body_line_batches(request):
+        output = []
+        for raw in lines:
+            line_number += 1
+            result = scan_line(line_number, raw)
+            if result:
+                matched_lines += 1
+                output.append(result)
+        if output:
+            results.write("".join(output).encode('utf-8'))
+    summary = {"lines": line_number, "matched_lines": matched_lines, "indicators": len(matcher)}
+    results.write((json.dumps({"summary": summary}) + "\n").encode('utf-8'))
+    results.seek(0)
+    return StreamingResponse(stream_spooled_file(results), media_type="application/x-ndjson")
+
 # ==================== WEB SCRAPING & LLM ANALYSIS ====================
 
 THREAT_SOURCES = [
@@ -1085,63 +1616,260 @@ THREAT_SOURCES = [
     "https://www.cyberscoop.com/feed/"
 ]
 
-async def scrape_threat_feeds():
-    try:
-        async with aiohttp.ClientSession() as session:
-            for source in THREAT_SOURCES:
-                try:
-                    feed = feedparser.parse(source)
-                    
-                    for entry in feed.entries[:5]:
-                        existing = await db.scraped_data.find_one({"url": entry.link})
-                        if existing:
-                            continue
-                        
-                        # Get published date
-                        published_date = datetime.now(timezone.utc)
-                        if hasattr(entry, 'published_parsed') and entry.published_parsed:
-                            published_date = datetime(*entry.published_parsed[:6], tzinfo=timezone.utc)
-                        
-                        scraped_doc = {
-                            "id": str(uuid.uuid4()),
-                            "title": entry.title,
-                            "url": entry.link,
-                            "summary": entry.get('summary', '')[:500],
-                            "source": source,
-                            "published_at": published_date.isoformat(),
-                            "processed": False
-                        }
-                        await db.scraped_data.insert_one(scraped_doc)
-                        
-                        intel_doc = {
-                            "id": str(uuid.uuid4()),
-                            "title": entry.title,
-                            "summary": entry.get('summary', '')[:300],
-                            "url": entry.link,
-                            "published_at": published_date.isoformat(),
-                            "source": source
-                        }
-                        await db.threat_intel.insert_one(intel_doc)
-                        
-                except Exception as e:
-                    logging.error(f"Error scraping {source}: {e}")
-                    continue
-                    
-    except Exception as e:
-        logging.error(f"Error in scrape_threat_feeds: {e}")
+# Feed ingestion tuning
+FEED_FETCH_CONCURRENCY = int(os.environ.get('FEED_FETCH_CONCURRENCY', '8'))
+FEED_FETCH_TIMEOUT_SECONDS = float(os.environ.get('FEED_FETCH_TIMEOUT_SECONDS', '20'))
+FEED_ENTRIES_PER_SOURCE = 5
+
+# feedparser is synchronous and CPU-bound, keep it off the event loop
+feed_parser_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('FEED_PARSER_WORKERS', '4')),
+    thread_name_prefix="feed-parser"
+)
 
-async def analyze_with_llm():
+async def get_feed_state(source: str) -> dict:
+    state = await db.feed_state.find_one({"source": source}, {"_id": 0})
+    return state or {}
+
+async def save_feed_state(source: str, validators: dict):
+    await db.feed_state.update_one(
+        {"source": source},
+        {"$set": {**validators, "fetched_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+async def fetch_feed(session: aiohttp.ClientSession, source: str, semaphore: asyncio.Semaphore) -> tuple:
+    """Conditionally download a feed as (content, validators); content is None when the source has not changed"""
+    state = await get_feed_state(source)
+    headers = {}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    
+    async with semaphore:
+        timeout = aiohttp.ClientTimeout(total=FEED_FETCH_TIMEOUT_SECONDS)
+        async with session.get(source, headers=headers, timeout=timeout) as response:
+            if response.status == 304:
+                return None, None
+            if not 200 <= response.status < 300:
+                # Surfaces as a failed scrape so dead feeds back off and trip the circuit breaker
+                raise ValueError(f"HTTP {response.status}")
+            content = await response.read()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+    
+    content_hash = hashlib.sha256(content).hexdigest()
+    validators = {"etag": etag, "last_modified": last_modified, "content_hash": content_hash}
+    # Some servers ignore validators, fall back to comparing the body
+    if content_hash == state.get('content_hash'):
+        return None, validators
+    return content, validators
+
+async def parse_feed(content: bytes):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(feed_parser_executor, feedparser.parse, content)
+
+async def insert_many_ignoring_duplicates(collection, documents: List[dict]) -> int:
+    """Unordered bulk insert that treats duplicate-key errors as already stored"""
+    if not documents:
+        return 0
     try:
-        unprocessed = await db.scraped_data.find({"processed": False}, {"_id": 0}).limit(2).to_list(2)
+        result = await collection.insert_many(documents, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        errors = e.details.get('writeErrors', [])
+        if any(err.get('code') != 11000 for err in errors):
+            raise
+        return e.details.get('nInserted', 0)
+
+async def store_feed_entries(source: str, entries: list) -> int:
+    # Dedup within the feed first, then against the database with a single $in query
+    candidates = {}
+    for entry in entries[:FEED_ENTRIES_PER_SOURCE]:
+        link = entry.get('link')
+        if link and link not in candidates:
+            candidates[link] = entry
+    if not candidates:
+        return 0
+    
+    existing = await db.scraped_data.find(
+        {"url": {"$in": list(candidates)}},
+        {"_id": 0, "url": 1}
+    ).to_list(len(candidates))
+    for doc in existing:
+        candidates.pop(doc['url'], None)
+    
+    scraped_docs = []
+    intel_docs = []
+    for link, entry in candidates.items():
+        # Get published date
+        published_date = datetime.now(timezone.utc)
+        if hasattr(entry, 'published_parsed') and entry.published_parsed:
+            published_date = datetime(*entry.published_parsed[:6], tzinfo=timezone.utc)
         
-        if not unprocessed:
-            return
+        scraped_docs.append({
+            "id": str(uuid.uuid4()),
+            "title": entry.title,
+            "url": link,
+            "summary": entry.get('summary', '')[:500],
+            "source": source,
+            "published_at": published_date,
+            "processed": False
+        })
+        intel_docs.append({
+            "id": str(uuid.uuid4()),
+            "title": entry.title,
+            "summary": entry.get('summary', '')[:300],
+            "url": link,
+            "published_at": published_date,
+            "source": source
+        })
+    
+    inserted = await insert_many_ignoring_duplicates(db.scraped_data, scraped_docs)
+    await insert_many_ignoring_duplicates(db.threat_intel, intel_docs)
+    return inserted
+
+def estimate_publish_interval(entries: list) -> Optional[float]:
+    """Median gap in seconds between the newest published entries of a feed"""
+    timestamps = sorted(
+        (time.mktime(entry.published_parsed) for entry in entries[:20]
+         if getattr(entry, 'published_parsed', None)),
+        reverse=True
+    )
+    gaps = sorted(a - b for a, b in zip(timestamps, timestamps[1:]) if a > b)
+    if not gaps:
+        return None
+    return gaps[len(gaps) // 2]
+
+async def scrape_source(session: aiohttp.ClientSession, source: str, semaphore: asyncio.Semaphore) -> dict:
+    """Scrape one source and report the outcome for the scheduler"""
+    try:
+        content, validators = await fetch_feed(session, source, semaphore)
+        if not content:
+            if validators:
+                await save_feed_state(source, validators)
+            return {"ok": True, "new_entries": 0, "publish_interval": None}
+        feed = await parse_feed(content)
+        if feed.bozo and not feed.entries:
+            raise ValueError(f"Unparseable feed: {feed.get('bozo_exception')}")
+        new_entries = await store_feed_entries(source, feed.entries)
+        # Validators only advance once the entries are stored, so a failed cycle is fetched again in full
+        await save_feed_state(source, validators)
+        return {
+            "ok": True,
+            "new_entries": new_entries,
+            "publish_interval": estimate_publish_interval(feed.entries)
+        }
+    except asyncio.TimeoutError:
+        logging.error(f"Timed out scraping {source} after {FEED_FETCH_TIMEOUT_SECONDS}s")
+        return {"ok": False, "error": "timeout"}
+    except Exception as e:
+        logging.error(f"Error scraping {source}: {e}")
+        return {"ok": False, "error": str(e)}
+
+# ==================== FEED SCHEDULER ====================
+
+FEED_MIN_INTERVAL_SECONDS = float(os.environ.get('FEED_MIN_INTERVAL_SECONDS', '120'))
+FEED_MAX_INTERVAL_SECONDS = float(os.environ.get('FEED_MAX_INTERVAL_SECONDS', '3600'))
+FEED_DEFAULT_INTERVAL_SECONDS = 300
+FEED_BACKOFF_BASE_SECONDS = 60
+FEED_CIRCUIT_FAILURE_THRESHOLD = 5
+FEED_CIRCUIT_OPEN_SECONDS = 6 * 3600
+SCHEDULER_TICK_SECONDS = 30
+
+# Per-source scheduling and health state, keyed by source URL
+source_health: Dict[str, dict] = {}
+
+def get_source_health(source: str) -> dict:
+    if source not in source_health:
+        source_health[source] = {
+            "source": source,
+            "interval_seconds": FEED_DEFAULT_INTERVAL_SECONDS,
+            "next_run": 0.0,
+            "last_run": None,
+            "last_success": None,
+            "last_error": None,
+            "consecutive_failures": 0,
+            "total_runs": 0,
+            "total_failures": 0,
+            "total_new_entries": 0,
+            "circuit": "closed"
+        }
+    return source_health[source]
+
+def record_source_result(source: str, result: dict):
+    """Update a source's schedule: adapt to its publishing rate, back off on failure"""
+    health = get_source_health(source)
+    now = time.time()
+    health["last_run"] = datetime.now(timezone.utc).isoformat()
+    health["total_runs"] += 1
+    
+    if result.get("ok"):
+        health["consecutive_failures"] = 0
+        health["circuit"] = "closed"
+        health["last_success"] = health["last_run"]
+        health["total_new_entries"] += result.get("new_entries", 0)
         
-        gemini_key = os.environ['GEMINI_API_KEY']
-        chat = LlmChat(
-            api_key=gemini_key,
-            session_id="threat_analysis",
-            system_message="""You are a cybersecurity threat intelligence analyst. Analyze threat articles and extract:
+        interval = health["interval_seconds"]
+        if result.get("publish_interval"):
+            # Poll about twice per publishing period
+            interval = result["publish_interval"] / 2
+        elif result.get("new_entries"):
+            interval = interval / 2
+        else:
+            interval = interval * 1.5
+        health["interval_seconds"] = min(FEED_MAX_INTERVAL_SECONDS, max(FEED_MIN_INTERVAL_SECONDS, interval))
+        health["next_run"] = now + health["interval_seconds"]
+        return
+    
+    health["consecutive_failures"] += 1
+    health["total_failures"] += 1
+    health["last_error"] = result.get("error")
+    if health["consecutive_failures"] >= FEED_CIRCUIT_FAILURE_THRESHOLD:
+        # Open the circuit; a single probe is allowed once it expires
+        if health["circuit"] != "open":
+            logging.warning(f"Circuit opened for {source} after {health['consecutive_failures']} failures")
+        health["circuit"] = "open"
+        health["next_run"] = now + FEED_CIRCUIT_OPEN_SECONDS
+    else:
+        backoff = FEED_BACKOFF_BASE_SECONDS * (2 ** (health["consecutive_failures"] - 1))
+        backoff = min(FEED_MAX_INTERVAL_SECONDS, backoff)
+        health["next_run"] = now + backoff * random.uniform(0.8, 1.2)
+
+async def run_feed_scheduler():
+    semaphore = asyncio.Semaphore(FEED_FETCH_CONCURRENCY)
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                sources = list(THREAT_SOURCES)
+                for removed in set(source_health) - set(sources):
+                    source_health.pop(removed, None)
+                
+                now = time.time()
+                due = [s for s in sources if get_source_health(s)["next_run"] <= now]
+                if due:
+                    results = await asyncio.gather(*[scrape_source(session, s, semaphore) for s in due])
+                    for source, result in zip(due, results):
+                        record_source_result(source, result)
+                
+                next_due = min((get_source_health(s)["next_run"] for s in sources), default=time.time() + SCHEDULER_TICK_SECONDS)
+                await asyncio.sleep(min(SCHEDULER_TICK_SECONDS, max(1, next_due - time.time())))
+            except Exception as e:
+                logging.error(f"Error in feed scheduler: {e}")
+                await asyncio.sleep(60)
+
+# ==================== LLM ANALYSIS WORKERS ====================
+
+LLM_CONCURRENCY = int(os.environ.get('LLM_CONCURRENCY', '4'))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', '60'))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', '250000'))
+LLM_MAX_RETRIES = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+LLM_BATCH_SIZE = int(os.environ.get('LLM_BATCH_SIZE', '50'))
+# Rough completion budget per analysis, used for token rate limiting
+LLM_EXPECTED_OUTPUT_TOKENS = 1200
+
+THREAT_ANALYSIS_SYSTEM_MESSAGE = """You are a cybersecurity threat intelligence analyst. Analyze threat articles and extract:
 1. Attack name
 2. Description (detailed and comprehensive)
 3. IOCs (IPs, domains, hashes)
@@ -1168,191 +1896,515 @@ Return ONLY valid JSON:
   "severity": "High",
   "mitigations": ["mitigation step 1", "mitigation step 2", "mitigation step 3"]
 }"""
-        ).with_model("gemini", "gemini-2.5-flash")
-        
-        for article in unprocessed:
-            try:
-                prompt = f"""Analyze this cybersecurity threat in detail:
+
+class RateLimiter:
+    """Sliding one-minute window limiting both requests and estimated tokens"""
+    
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = []  # (timestamp, tokens)
+        self.lock = asyncio.Lock()
+    
+    async def acquire(self, tokens: int):
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            async with self.lock:
+                now = time.monotonic()
+                self.window = [(t, n) for t, n in self.window if now - t < 60]
+                used_tokens = sum(n for _, n in self.window)
+                if len(self.window) < self.requests_per_minute and used_tokens + tokens <= self.tokens_per_minute:
+                    self.window.append((now, tokens))
+                    return
+                wait = 60 - (now - self.window[0][0]) if self.window else 1
+            await asyncio.sleep(max(0.05, wait))
+
+llm_rate_limiter = RateLimiter(LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
+
+# Bump whenever the analysis prompt or system message changes so stale analyses are not reused
+ANALYSIS_PROMPT_VERSION = "1"
+LLM_CACHE_TTL_DAYS = int(os.environ.get('LLM_CACHE_TTL_DAYS', '30'))
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '50000'))
+llm_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def analysis_cache_key(article: dict) -> str:
+    """Content hash of the article so syndicated copies under other URLs share an analysis"""
+    text = f"{article.get('title', '')}\n{article.get('summary', '')}"
+    text = re.sub(r'<[^>]+>', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip().lower()
+    return hashlib.sha256(f"{ANALYSIS_PROMPT_VERSION}:{text}".encode('utf-8')).hexdigest()
+
+async def get_cached_analysis(key: str) -> Optional[dict]:
+    cached = await db.llm_analysis_cache.find_one_and_update(
+        {"key": key},
+        {"$set": {"last_used_at": datetime.now(timezone.utc)}, "$inc": {"hits": 1}},
+        projection={"_id": 0, "attack_data": 1}
+    )
+    if cached:
+        llm_cache_stats["hits"] += 1
+        return cached["attack_data"]
+    llm_cache_stats["misses"] += 1
+    return None
+
+async def store_cached_analysis(key: str, attack_data: dict):
+    now = datetime.now(timezone.utc)
+    await db.llm_analysis_cache.update_one(
+        {"key": key},
+        {"$set": {
+            "attack_data": attack_data,
+            "prompt_version": ANALYSIS_PROMPT_VERSION,
+            "created_at": now,
+            "last_used_at": now
+        }, "$setOnInsert": {"hits": 0}},
+        upsert=True
+    )
+    
+    # LRU eviction on top of the TTL index
+    excess = await db.llm_analysis_cache.estimated_document_count() - LLM_CACHE_MAX_ENTRIES
+    if excess > 0:
+        stale = await db.llm_analysis_cache.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess).to_list(excess)
+        result = await db.llm_analysis_cache.delete_many({"_id": {"$in": [doc["_id"] for doc in stale]}})
+        llm_cache_stats["evictions"] += result.deleted_count
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+def build_analysis_prompt(article: dict) -> str:
+    return f"""Analyze this cybersecurity threat in detail:
 
 Title: {article['title']}
 URL: {article['url']}
 Summary: {article['summary']}
 
 Provide comprehensive threat intelligence with detailed description and actionable mitigation steps in JSON format."""
-                
-                message = UserMessage(text=prompt)
-                response = await chat.send_message(message)
-                
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL)
-                if json_match:
-                    attack_data = json.loads(json_match.group())
-                    
-                    attack = AttackProfile(
-                        name=attack_data.get('name', article['title']),
-                        description=attack_data.get('description', ''),
-                        iocs=attack_data.get('iocs', []),
-                        ttps=attack_data.get('ttps', []),
-                        mitre_tactics=attack_data.get('mitre_tactics', []),
-                        threat_actor=attack_data.get('threat_actor'),
-                        tags={
-                            "industries": attack_data.get('industries', ['Global']),
-                            "regions": attack_data.get('regions', ['Global']),
-                            "sec_solutions": attack_data.get('sec_solutions', ['All'])
-                        },
-                        source_url=article['url'],
-                        severity=attack_data.get('severity', 'Medium')
-                    )
-                    
-                    attack_dict = attack.model_dump()
-                    attack_dict['discovered_at'] = attack_dict['discovered_at'].isoformat()
-                    # Store mitigations separately
-                    attack_dict['mitigations'] = attack_data.get('mitigations', [])
-                    await db.attacks.insert_one(attack_dict)
-                    
-                    await match_attacks_to_users(attack)
-                    
-                await db.scraped_data.update_one(
-                    {"id": article['id']},
-                    {"$set": {"processed": True}}
-                )
-                
-            except Exception as e:
-                logging.error(f"Error analyzing article {article['id']}: {e}")
-                await db.scraped_data.update_one(
-                    {"id": article['id']},
-                    {"$set": {"processed": True}}
-                )
-                continue
+
+async def request_llm_analysis(article: dict) -> Optional[dict]:
+    """Ask the model to analyze an article, retrying with jittered exponential backoff"""
+    prompt = build_analysis_prompt(article)
+    token_estimate = estimate_tokens(THREAT_ANALYSIS_SYSTEM_MESSAGE + prompt) + LLM_EXPECTED_OUTPUT_TOKENS
+    
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        await llm_rate_limiter.acquire(token_estimate)
+        try:
+            # A fresh session per article so concurrent calls never share history
+            chat = LlmChat(
+                api_key=os.environ['GEMINI_API_KEY'],
+                session_id=f"threat_analysis_{article['id']}",
+                system_message=THREAT_ANALYSIS_SYSTEM_MESSAGE
+            ).with_model("gemini", "gemini-2.5-flash")
+            response = await chat.send_message(UserMessage(text=prompt))
+            break
+        except Exception as e:
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            delay = random.uniform(0, min(60, 2 ** (attempt + 1)))
+            logging.warning(f"LLM analysis of {article['id']} failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', response, re.DOTALL)
+    if not json_match:
+        return None
+    return json.loads(json_match.group())
+
+async def save_attack_analysis(article: dict, attack_data: dict):
+    attack = AttackProfile(
+        name=attack_data.get('name', article['title']),
+        description=attack_data.get('description', ''),
+        iocs=attack_data.get('iocs', []),
+        ttps=attack_data.get('ttps', []),
+        mitre_tactics=attack_data.get('mitre_tactics', []),
+        threat_actor=attack_data.get('threat_actor'),
+        tags={
+            "industries": attack_data.get('industries', ['Global']),
+            "regions": attack_data.get('regions', ['Global']),
+            "sec_solutions": attack_data.get('sec_solutions', ['All'])
+        },
+        source_url=article['url'],
+        severity=attack_data.get('severity', 'Medium')
+    )
+    
+    attack_dict = attack.model_dump()
+    # Store mitigations separately
+    attack_dict['mitigations'] = attack_data.get('mitigations', [])
+    await db.attacks.insert_one(attack_dict)
+    
+    await match_attacks_to_users(attack)
+
+async def analyze_article(article: dict):
+    try:
+        cache_key = analysis_cache_key(article)
+        attack_data = await get_cached_analysis(cache_key)
+        if attack_data is None:
+            attack_data = await request_llm_analysis(article)
+            if attack_data:
+                await store_cached_analysis(cache_key, attack_data)
+        if attack_data:
+            await save_attack_analysis(article, attack_data)
+    except Exception as e:
+        logging.error(f"Error analyzing article {article['id']}: {e}")
+    
+    await db.scraped_data.update_one(
+        {"id": article['id']},
+        {"$set": {"processed": True}}
+    )
+
+async def analysis_worker(queue: asyncio.Queue):
+    while True:
+        article = await queue.get()
+        try:
+            await analyze_article(article)
+        except Exception as e:
+            # A worker that died here would leave queue.join() waiting forever; the
+            # article stays unprocessed and is picked up by the next batch
+            logging.error(f"Error finishing article {article['id']}: {e}")
+        finally:
+            queue.task_done()
+
+async def analyze_with_llm() -> int:
+    """Analyze a batch of unprocessed articles with a bounded worker pool; returns the batch size"""
+    try:
+        unprocessed = await db.scraped_data.find({"processed": False}, {"_id": 0}).limit(LLM_BATCH_SIZE).to_list(LLM_BATCH_SIZE)
+        
+        if not unprocessed:
+            return 0
+        
+        queue = asyncio.Queue()
+        for article in unprocessed:
+            queue.put_nowait(article)
+        
+        workers = [
+            asyncio.create_task(analysis_worker(queue))
+            for _ in range(min(LLM_CONCURRENCY, len(unprocessed)))
+        ]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return len(unprocessed)
                 
     except Exception as e:
         logging.error(f"Error in analyze_with_llm: {e}")
+        return 0
+
+# ==================== THREAT MATCHING ====================
+
+class ProfileTagIndex:
+    """Inverted index from profile tags to user_ids for attack-to-tenant matching"""
+    
+    def __init__(self):
+        self.by_industry: Dict[str, set] = {}
+        self.by_region: Dict[str, set] = {}
+        self.by_solution: Dict[str, set] = {}
+        self.with_solutions: set = set()
+        self.all_users: set = set()
+        self.tags: Dict[str, dict] = {}
+    
+    def add(self, user_id: str, tags: dict):
+        self.remove(user_id)
+        tags = {
+            "industry": tags.get('industry'),
+            "region": tags.get('region'),
+            "sec_solutions": list(tags.get('sec_solutions') or [])
+        }
+        self.tags[user_id] = tags
+        self.all_users.add(user_id)
+        self.by_industry.setdefault(tags['industry'], set()).add(user_id)
+        self.by_region.setdefault(tags['region'], set()).add(user_id)
+        for solution in tags['sec_solutions']:
+            self.by_solution.setdefault(solution, set()).add(user_id)
+        if tags['sec_solutions']:
+            self.with_solutions.add(user_id)
+    
+    def remove(self, user_id: str):
+        tags = self.tags.pop(user_id, None)
+        if not tags:
+            return
+        self.all_users.discard(user_id)
+        self.with_solutions.discard(user_id)
+        self.by_industry.get(tags['industry'], set()).discard(user_id)
+        self.by_region.get(tags['region'], set()).discard(user_id)
+        for solution in tags['sec_solutions']:
+            self.by_solution.get(solution, set()).discard(user_id)
+    
+    def _union(self, index: Dict[str, set], keys: List[str]) -> set:
+        result = set()
+        for key in keys:
+            result |= index.get(key, set())
+        return result
+    
+    def match(self, attack_tags: dict) -> set:
+        """User ids scoring >= 2 on industry, region and security-solution overlap"""
+        industries = attack_tags.get('industries', [])
+        regions = attack_tags.get('regions', [])
+        solutions = attack_tags.get('sec_solutions', [])
+        
+        industry_hits = self.all_users if 'Global' in industries else self._union(self.by_industry, industries)
+        region_hits = self.all_users if 'Global' in regions else self._union(self.by_region, regions)
+        solution_hits = self.with_solutions if 'All' in solutions else self._union(self.by_solution, solutions)
+        
+        return (industry_hits & region_hits) | (industry_hits & solution_hits) | (region_hits & solution_hits)
+
+profile_tag_index = ProfileTagIndex()
+
+async def load_profile_tag_index():
+    async for profile in db.profiles.find({}, {"_id": 0, "user_id": 1, "tags": 1}):
+        profile_tag_index.add(profile['user_id'], profile.get('tags', {}))
+    logging.info(f"Profile tag index loaded with {len(profile_tag_index.all_users)} tenants")
+
+USER_ATTACK_BATCH_SIZE = 1000
+
+def attack_match_filter(profile_tags: dict) -> dict:
+    """Mongo filter for attacks scoring >= 2 against a profile's tags"""
+    industry = {"tags.industries": {"$in": [profile_tags['industry'], 'Global']}}
+    region = {"tags.regions": {"$in": [profile_tags['region'], 'Global']}}
+    clauses = [{"$and": [industry, region]}]
+    if profile_tags.get('sec_solutions'):
+        solution = {"tags.sec_solutions": {"$in": list(profile_tags['sec_solutions']) + ['All']}}
+        clauses += [{"$and": [industry, solution]}, {"$and": [region, solution]}]
+    return {"$or": clauses}
+
+async def write_user_attack_links(links: List[dict]) -> List[dict]:
+    """Upsert user_attacks links in bulk; returns only the links that were newly created"""
+    created = []
+    for start in range(0, len(links), USER_ATTACK_BATCH_SIZE):
+        batch = links[start:start + USER_ATTACK_BATCH_SIZE]
+        operations = [
+            UpdateOne(
+                {"user_id": link['user_id'], "attack_id": link['attack_id']},
+                {"$setOnInsert": link},
+                upsert=True
+            )
+            for link in batch
+        ]
+        try:
+            result = await db.user_attacks.bulk_write(operations, ordered=False)
+            upserted = result.upserted_ids
+        except BulkWriteError as e:
+            # A concurrent writer won the race on the unique index; its link stands
+            if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                raise
+            upserted = {op['index']: op['_id'] for op in e.details.get('upserted', [])}
+        created.extend(batch[index] for index in upserted)
+    
+    await increment_tenant_summaries(created)
+    for user_id in {link['user_id'] for link in created}:
+        geo_map_cache.pop(user_id, None)
+    return created
 
 async def match_attacks_to_users(attack: AttackProfile):
     try:
-        profiles = await db.profiles.find({}, {"_id": 0}).to_list(1000)
+        matched_user_ids = profile_tag_index.match(attack.tags)
         
-        for profile in profiles:
-            match_score = 0
-            
-            if profile['tags']['industry'] in attack.tags['industries'] or 'Global' in attack.tags['industries']:
-                match_score += 1
-            
-            if profile['tags']['region'] in attack.tags['regions'] or 'Global' in attack.tags['regions']:
-                match_score += 1
-            
-            for solution in profile['tags']['sec_solutions']:
-                if solution in attack.tags['sec_solutions'] or 'All' in attack.tags['sec_solutions']:
-                    match_score += 1
-                    break
-            
-            if match_score >= 2:
-                existing = await db.user_attacks.find_one({
-                    "user_id": profile['user_id'],
-                    "attack_id": attack.id
-                })
+        linked_at = datetime.now(timezone.utc)
+        links = [{
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "attack_id": attack.id,
+            "name": attack.name,
+            "description": attack.description,
+            "severity": attack.severity,
+            "source_url": attack.source_url,
+            "threat_actor": attack.threat_actor,
+            "ttps": attack.ttps,
+            "iocs": attack.iocs,
+            "discovered_at": attack.discovered_at,
+            "linked_at": linked_at
+        } for user_id in matched_user_ids]
+        
+        new_links = await write_user_attack_links(links)
+        if new_links:
+            await ensure_attack_rules([attack.model_dump()])
                 
-                if not existing:
-                    user_attack = {
-                        "id": str(uuid.uuid4()),
-                        "user_id": profile['user_id'],
-                        "attack_id": attack.id,
-                        "name": attack.name,
-                        "description": attack.description,
-                        "severity": attack.severity,
-                        "source_url": attack.source_url,
-                        "threat_actor": attack.threat_actor,
-                        "discovered_at": attack.discovered_at.isoformat(),
-                        "linked_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    await db.user_attacks.insert_one(user_attack)
-                    await generate_rules(attack, profile['tags']['sec_solutions'])
-                    
     except Exception as e:
         logging.error(f"Error in match_attacks_to_users: {e}")
 
 async def match_user_to_existing_attacks(profile: CompanyProfile):
     """Match a new user profile to existing attacks in the database"""
     try:
-        attacks = await db.attacks.find({}, {"_id": 0}).to_list(1000)
+        linked_at = datetime.now(timezone.utc)
+        attacks_by_id = {}
+        links = []
+        async for attack in db.attacks.find(attack_match_filter(profile.tags), {"_id": 0}):
+            attacks_by_id[attack['id']] = attack
+            links.append({
+                "id": str(uuid.uuid4()),
+                "user_id": profile.user_id,
+                "attack_id": attack['id'],
+                "name": attack['name'],
+                "description": attack['description'],
+                "severity": attack['severity'],
+                "source_url": attack['source_url'],
+                "threat_actor": attack.get('threat_actor'),
+                "ttps": attack.get('ttps', []),
+                "iocs": attack.get('iocs', []),
+                "discovered_at": attack['discovered_at'],
+                "linked_at": linked_at
+            })
         
-        for attack in attacks:
-            match_score = 0
-            
-            # Check industry match
-            if profile.tags['industry'] in attack['tags']['industries'] or 'Global' in attack['tags']['industries']:
-                match_score += 1
-            
-            # Check region match
-            if profile.tags['region'] in attack['tags']['regions'] or 'Global' in attack['tags']['regions']:
-                match_score += 1
-            
-            # Check security solutions match
-            for solution in profile.tags['sec_solutions']:
-                if solution in attack['tags']['sec_solutions'] or 'All' in attack['tags']['sec_solutions']:
-                    match_score += 1
-                    break
-            
-            # If match score is 2 or higher, link the attack to the user
-            if match_score >= 2:
-                existing = await db.user_attacks.find_one({
-                    "user_id": profile.user_id,
-                    "attack_id": attack['id']
-                })
-                
-                if not existing:
-                    user_attack = {
-                        "id": str(uuid.uuid4()),
-                        "user_id": profile.user_id,
-                        "attack_id": attack['id'],
-                        "name": attack['name'],
-                        "description": attack['description'],
-                        "severity": attack['severity'],
-                        "source_url": attack['source_url'],
-                        "threat_actor": attack.get('threat_actor'),
-                        "discovered_at": attack['discovered_at'],
-                        "linked_at": datetime.now(timezone.utc).isoformat()
-                    }
-                    await db.user_attacks.insert_one(user_attack)
-                    await generate_rules_for_attack(attack, profile.tags['sec_solutions'])
+        new_links = await write_user_attack_links(links)
+        await ensure_attack_rules([attacks_by_id[link['attack_id']] for link in new_links])
                     
     except Exception as e:
         logging.error(f"Error in match_user_to_existing_attacks: {e}")
 
-async def generate_rules_for_attack(attack: dict, sec_solutions: List[str]):
-    """Generate rules for a specific attack and user"""
-    try:
-        # Check if rules already exist for this attack
-        existing_yara = await db.yara_rules.find_one({"attack_id": attack['id']})
-        existing_sigma = await db.sigma_rules.find_one({"attack_id": attack['id']})
-        
-        if not existing_yara:
-            yara_rule_content = f"""rule {attack['name'].replace(' ', '_')}_Detection
+async def backfill_link_search_fields():
+    """Copy ttps and iocs from attacks onto links created before they were denormalized; safe to run repeatedly"""
+    missing = {"$or": [{"ttps": {"$exists": False}}, {"iocs": {"$exists": False}}]}
+    backfilled = 0
+    while True:
+        attack_ids = {
+            link['attack_id']
+            for link in await db.user_attacks.find(missing, {"_id": 0, "attack_id": 1}).limit(USER_ATTACK_BATCH_SIZE).to_list(USER_ATTACK_BATCH_SIZE)
+        }
+        if not attack_ids:
+            break
+        attacks = {
+            attack['id']: attack
+            async for attack in db.attacks.find({"id": {"$in": list(attack_ids)}}, {"_id": 0, "id": 1, "ttps": 1, "iocs": 1})
+        }
+        # Links to deleted attacks get empty lists so they are not picked up again
+        operations = [
+            UpdateMany(
+                {"attack_id": attack_id, **missing},
+                {"$set": {"ttps": attacks.get(attack_id, {}).get('ttps') or [], "iocs": attacks.get(attack_id, {}).get('iocs') or []}}
+            )
+            for attack_id in attack_ids
+        ]
+        result = await db.user_attacks.bulk_write(operations, ordered=False)
+        backfilled += result.modified_count
+    if backfilled:
+        logging.info(f"Copied ttps and iocs onto {backfilled} user_attacks links")
+
+# ==================== TENANT SUMMARY ====================
+
+def encode_summary_key(value: Optional[str]) -> str:
+    # Mongo field names cannot contain '.' or start with '$'
+    return (value or "Unknown").replace('.', '\uff0e').replace('$', '\uff04')
+
+def decode_summary_key(key: str) -> str:
+    return key.replace('\uff0e', '.').replace('\uff04', '$')
+
+def timeline_entry(link: dict) -> dict:
+    return {
+        "id": link.get('id'),
+        "attack_id": link.get('attack_id'),
+        "name": link.get('name'),
+        "severity": link.get('severity'),
+        "timestamp": link.get('discovered_at')
+    }
+
+def summary_day(discovered_at) -> str:
+    return as_datetime(discovered_at).strftime("%Y-%m-%d")
+
+async def increment_tenant_summaries(links: List[dict]):
+    """Fold newly created links into existing tenant summaries with atomic $inc/$push"""
+    by_user: Dict[str, List[dict]] = {}
+    for link in links:
+        by_user.setdefault(link['user_id'], []).append(link)
+    
+    operations = []
+    for user_id, user_links in by_user.items():
+        increments = {"total": len(user_links)}
+        for link in user_links:
+            for field in (
+                f"severity.{encode_summary_key(link.get('severity'))}",
+                f"threat_actors.{encode_summary_key(link.get('threat_actor'))}",
+                f"daily.{summary_day(link['discovered_at'])}"
+            ):
+                increments[field] = increments.get(field, 0) + 1
+        operations.append(UpdateOne(
+            {"user_id": user_id},
+            {
+                "$inc": increments,
+                "$push": {"recent": {
+                    "$each": [timeline_entry(link) for link in user_links],
+                    "$sort": {"timestamp": -1, "id": -1},
+                    "$slice": SUMMARY_RECENT_LIMIT
+                }},
+                "$set": {"updated_at": datetime.now(timezone.utc)}
+            }
+        ))
+    # No upsert: a tenant without a summary gets one rebuilt from every link on first read,
+    # rather than a summary that only counts these links
+    if operations:
+        await db.tenant_summary.bulk_write(operations, ordered=False)
+
+async def rebuild_tenant_summary(user_id: str) -> dict:
+    """Recompute a tenant's summary from user_attacks, correcting any drift"""
+    result = await db.user_attacks.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$facet": {
+            "severity": [{"$group": {"_id": "$severity", "count": {"$sum": 1}}}],
+            "threat_actors": [{"$group": {"_id": "$threat_actor", "count": {"$sum": 1}}}],
+            # $dateToString fails on ISO strings left over from before the datetime migration
+            "daily": [
+                {"$match": {"discovered_at": {"$type": "date"}}},
+                {"$group": {"_id": {"$dateToString": {"format": "%Y-%m-%d", "date": "$discovered_at"}}, "count": {"$sum": 1}}}
+            ],
+            "recent": [
+                {"$sort": {"discovered_at": -1, "id": -1}},
+                {"$limit": SUMMARY_RECENT_LIMIT},
+                {"$project": {"_id": 0, "id": 1, "attack_id": 1, "name": 1, "severity": 1, "discovered_at": 1}}
+            ]
+        }}
+    ]).to_list(1)
+    facets = result[0]
+    
+    summary = {
+        "user_id": user_id,
+        "total": sum(bucket["count"] for bucket in facets["severity"]),
+        "severity": {encode_summary_key(b["_id"]): b["count"] for b in facets["severity"]},
+        "threat_actors": {encode_summary_key(b["_id"]): b["count"] for b in facets["threat_actors"]},
+        "daily": {b["_id"]: b["count"] for b in facets["daily"] if b["_id"]},
+        "recent": [timeline_entry(link) for link in facets["recent"]],
+        "updated_at": datetime.now(timezone.utc)
+    }
+    await db.tenant_summary.replace_one({"user_id": user_id}, summary, upsert=True)
+    return summary
+
+async def get_tenant_summary(user_id: str) -> dict:
+    summary = await db.tenant_summary.find_one({"user_id": user_id}, {"_id": 0})
+    if not summary:
+        # Tenants that predate the summary collection are built on first read
+        summary = await rebuild_tenant_summary(user_id)
+    for field in ("severity", "threat_actors", "daily"):
+        summary.setdefault(field, {})
+    summary.setdefault("recent", [])
+    summary.setdefault("total", 0)
+    return summary
+
+# ==================== DETECTION RULES ====================
+
+# Bump to regenerate detection rules when the templates below change
+RULE_TEMPLATE_VERSION = 1
+
+def build_yara_rule(attack: dict) -> str:
+    iocs = attack.get('iocs') or []
+    ttps = attack.get('ttps') or []
+    return f"""rule {attack['name'].replace(' ', '_')}_Detection
 {{
     meta:
         description = "{attack['description']}"
         severity = "{attack['severity']}"
-        threat_actor = "{attack.get('threat_actor', 'Unknown')}"
+        threat_actor = "{attack.get('threat_actor') or 'Unknown'}"
         source = "{attack['source_url']}"
-        mitre_tactics = "{', '.join(attack.get('mitre_tactics', []))}"
+        mitre_tactics = "{', '.join(attack.get('mitre_tactics') or [])}"
     
     strings:
-        $ioc1 = "{attack['iocs'][0] if attack.get('iocs') else 'malicious_indicator'}"
-        $ttp1 = "{attack['ttps'][0] if attack.get('ttps') else 'suspicious_behavior'}"
+        $ioc1 = "{iocs[0] if iocs else 'malicious_indicator'}"
+        $ttp1 = "{ttps[0] if ttps else 'suspicious_behavior'}"
     
     condition:
         any of them
 }}"""
-            
-            yara_rule = {
-                "id": str(uuid.uuid4()),
-                "attack_id": attack['id'],
-                "rule_name": f"{attack['name'].replace(' ', '_')}_Yara",
-                "rule_content": yara_rule_content
-            }
-            await db.yara_rules.insert_one(yara_rule)
-        
-        if not existing_sigma:
-            sigma_rule_content = f"""title: {attack['name']} Detection
+
+def build_sigma_rule(attack: dict) -> str:
+    iocs = attack.get('iocs') or []
+    ttps = attack.get('ttps') or []
+    mitre_tactics = attack.get('mitre_tactics') or []
+    mitre_tag = mitre_tactics[0].lower().replace(' ', '_') if mitre_tactics else 'unknown'
+    return f"""title: {attack['name']} Detection
 id: {str(uuid.uuid4())}
 status: experimental
 description: Detects {attack['description']}
@@ -1361,106 +2413,409 @@ date: {datetime.now(timezone.utc).strftime('%Y/%m/%d')}
 references:
     - {attack['source_url']}
 tags:
-    - attack.{attack.get('mitre_tactics', ['unknown'])[0].lower().replace(' ', '_')}
+    - attack.{mitre_tag}
 logsource:
     category: process_creation
     product: windows
 detection:
     selection:
         CommandLine|contains:
-            - '{attack.get('iocs', ['malicious'])[0]}'
-            - '{attack.get('ttps', ['suspicious'])[0]}'
+            - '{iocs[0] if iocs else 'malicious'}'
+            - '{ttps[0] if ttps else 'suspicious'}'
     condition: selection
 falsepositives:
     - Legitimate administrative activity
 level: {attack['severity'].lower()}"""
-            
-            sigma_rule = {
-                "id": str(uuid.uuid4()),
-                "attack_id": attack['id'],
-                "rule_name": f"{attack['name'].replace(' ', '_')}_Sigma",
-                "rule_content": sigma_rule_content
-            }
-            await db.sigma_rules.insert_one(sigma_rule)
-            
-    except Exception as e:
-        logging.error(f"Error generating rules for attack: {e}")
 
-async def generate_rules(attack: AttackProfile, sec_solutions: List[str]):
+async def ensure_attack_rules(attacks: List[dict]):
+    """Idempotently create one Yara and one Sigma rule per attack for the current template version"""
+    if not attacks:
+        return
     try:
-        yara_rule_content = f"""rule {attack.name.replace(' ', '_')}_Detection
-{{
-    meta:
-        description = "{attack.description}"
-        severity = "{attack.severity}"
-        threat_actor = "{attack.threat_actor or 'Unknown'}"
-        source = "{attack.source_url}"
-        mitre_tactics = "{', '.join(attack.mitre_tactics)}"
-    
-    strings:
-        $ioc1 = "{attack.iocs[0] if attack.iocs else 'malicious_indicator'}"
-        $ttp1 = "{attack.ttps[0] if attack.ttps else 'suspicious_behavior'}"
-    
-    condition:
-        any of them
-}}"""
-        
-        yara_rule = {
-            "id": str(uuid.uuid4()),
-            "attack_id": attack.id,
-            "rule_name": f"{attack.name.replace(' ', '_')}_Yara",
-            "rule_content": yara_rule_content
-        }
-        await db.yara_rules.insert_one(yara_rule)
-        
-        mitre_tag = attack.mitre_tactics[0].lower().replace(' ', '_') if attack.mitre_tactics and len(attack.mitre_tactics) > 0 else 'unknown'
-        sigma_rule_content = f"""title: {attack.name} Detection
-id: {str(uuid.uuid4())}
-status: experimental
-description: Detects {attack.description}
-author: Intellisecure AI
-date: {datetime.now(timezone.utc).strftime('%Y/%m/%d')}
-references:
-    - {attack.source_url}
-tags:
-    - attack.{mitre_tag}
-logsource:
-    category: process_creation
-    product: windows
-detection:
-    selection:
-        CommandLine|contains:
-            - '{attack.iocs[0] if attack.iocs else 'malicious'}'
-            - '{attack.ttps[0] if attack.ttps else 'suspicious'}'
-    condition: selection
-falsepositives:
-    - Legitimate administrative activity
-level: {attack.severity.lower()}"""
-        
-        sigma_rule = {
-            "id": str(uuid.uuid4()),
-            "attack_id": attack.id,
-            "rule_name": f"{attack.name.replace(' ', '_')}_Sigma",
-            "rule_content": sigma_rule_content
-        }
-        await db.sigma_rules.insert_one(sigma_rule)
-        
+        for collection, suffix, build in (
+            (db.yara_rules, "Yara", build_yara_rule),
+            (db.sigma_rules, "Sigma", build_sigma_rule)
+        ):
+            operations = [
+                UpdateOne(
+                    {"attack_id": attack['id'], "template_version": RULE_TEMPLATE_VERSION},
+                    {"$setOnInsert": {
+                        "id": str(uuid.uuid4()),
+                        "rule_name": f"{attack['name'].replace(' ', '_')}_{suffix}",
+                        "rule_content": build(attack)
+                    }},
+                    upsert=True
+                )
+                for attack in attacks
+            ]
+            try:
+                await collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                if any(err.get('code') != 11000 for err in e.details.get('writeErrors', [])):
+                    raise
     except Exception as e:
         logging.error(f"Error generating rules: {e}")
 
-async def run_background_tasks():
+async def current_attack_rules(attack_id: str, attack: Optional[dict] = None) -> tuple:
+    """Yara and Sigma rules of the current template version, generated on first read when missing"""
+    query = {"attack_id": attack_id, "template_version": RULE_TEMPLATE_VERSION}
+    yara_rules, sigma_rules = await asyncio.gather(
+        db.yara_rules.find(query, {"_id": 0}).to_list(10),
+        db.sigma_rules.find(query, {"_id": 0}).to_list(10)
+    )
+    if yara_rules and sigma_rules:
+        return yara_rules, sigma_rules
+    
+    # Legacy attacks and attacks from before a template version bump
+    attack = attack or await db.attacks.find_one({"id": attack_id}, {"_id": 0})
+    if not attack:
+        return yara_rules, sigma_rules
+    await ensure_attack_rules([attack])
+    return await asyncio.gather(
+        db.yara_rules.find(query, {"_id": 0}).to_list(10),
+        db.sigma_rules.find(query, {"_id": 0}).to_list(10)
+    )
+
+async def prune_detection_rules():
+    """Collapse legacy duplicate rules to one per attack and drop rules of older template versions"""
+    for collection in (db.yara_rules, db.sigma_rules):
+        try:
+            # Keep the most recently updated legacy rule, which carries any admin edits
+            legacy = collection.aggregate([
+                {"$match": {"template_version": {"$exists": False}}},
+                {"$sort": {"updated_at": -1}},
+                {"$group": {"_id": "$attack_id", "keep": {"$first": "$_id"}}}
+            ])
+            promoted = 0
+            async for group in legacy:
+                if await collection.find_one({"attack_id": group["_id"], "template_version": RULE_TEMPLATE_VERSION}, {"_id": 1}):
+                    continue
+                try:
+                    await collection.update_one({"_id": group["keep"]}, {"$set": {"template_version": RULE_TEMPLATE_VERSION}})
+                    promoted += 1
+                except DuplicateKeyError:
+                    # Generated concurrently for this attack
+                    pass
+            result = await collection.delete_many({"template_version": {"$ne": RULE_TEMPLATE_VERSION}})
+            if promoted or result.deleted_count:
+                logging.info(f"{collection.name}: kept {promoted} legacy rules, removed {result.deleted_count} stale rules")
+        except Exception as e:
+            logging.error(f"Error pruning {collection.name}: {e}")
+
+# ==================== WEEKLY REPORT PRE-GENERATION ====================
+
+# Reports for the new ISO week start rendering at this UTC hour on Monday
+REPORT_PREGEN_START_HOUR = int(os.environ.get('REPORT_PREGEN_START_HOUR', '2'))
+# Job starts are spread evenly over this window
+REPORT_PREGEN_WINDOW_SECONDS = int(os.environ.get('REPORT_PREGEN_WINDOW_SECONDS', str(3 * 3600)))
+REPORT_PREGEN_CONCURRENCY = int(os.environ.get('REPORT_PREGEN_CONCURRENCY', '2'))
+REPORT_RETENTION_WEEKS = int(os.environ.get('REPORT_RETENTION_WEEKS', '8'))
+REPORT_PREGEN_CHECK_SECONDS = 900
+REPORT_STALE_JOB_SECONDS = 3600
+
+async def seed_report_jobs(week: str):
+    """Create a pending job per tenant; existing jobs for the week are left untouched"""
+    operations = [
+        UpdateOne(
+            {"week": week, "user_id": user_id},
+            {"$setOnInsert": {"status": "pending", "attempts": 0, "created_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        for user_id in await db.profiles.distinct("user_id")
+    ]
+    if operations:
+        await db.report_jobs.bulk_write(operations, ordered=False)
+
+async def run_report_job(job: dict, semaphore: asyncio.Semaphore, now: datetime):
+    async with semaphore:
+        claimed = await db.report_jobs.find_one_and_update(
+            {"week": job["week"], "user_id": job["user_id"], "status": "pending"},
+            {"$set": {"status": "running", "started_at": datetime.now(timezone.utc)}, "$inc": {"attempts": 1}}
+        )
+        if not claimed:
+            return
+        try:
+            profile = await db.profiles.find_one({"user_id": job["user_id"]}, {"_id": 0})
+            if not profile:
+                await db.report_jobs.delete_one({"week": job["week"], "user_id": job["user_id"]})
+                return
+            # Taken before rendering so links that land mid-render make the report stale
+            rendered_at = datetime.now(timezone.utc)
+            pdf = await build_weekly_report(profile, now)
+            file_id = await report_files.upload_from_stream(
+                f"{job['user_id']}_{job['week']}.pdf",
+                io.BytesIO(pdf),
+                metadata={"user_id": job["user_id"], "week": job["week"], "created_at": datetime.now(timezone.utc)}
+            )
+            await db.report_jobs.update_one(
+                {"week": job["week"], "user_id": job["user_id"]},
+                {"$set": {"status": "done", "file_id": file_id, "rendered_at": rendered_at}}
+            )
+        except Exception as e:
+            logging.error(f"Error pre-generating report for {job['user_id']}: {e}")
+            # Retried on the next pass until attempts run out
+            status = "pending" if claimed.get("attempts", 0) + 1 < 3 else "failed"
+            await db.report_jobs.update_one(
+                {"week": job["week"], "user_id": job["user_id"]},
+                {"$set": {"status": status, "error": str(e)}}
+            )
+
+async def purge_old_reports(now: datetime):
+    cutoff = now - timedelta(weeks=REPORT_RETENTION_WEEKS)
+    async for grid_file in report_files.find({"metadata.created_at": {"$lt": cutoff}}):
+        await report_files.delete(grid_file._id)
+    await db.report_jobs.delete_many({"created_at": {"$lt": cutoff}})
+
+def report_pregen_start(now: datetime) -> datetime:
+    return (now - timedelta(days=now.weekday())).replace(hour=REPORT_PREGEN_START_HOUR, minute=0, second=0, microsecond=0)
+
+async def pregenerate_weekly_reports(now: datetime):
+    week = report_week(now)
+    window_end = report_pregen_start(now) + timedelta(seconds=REPORT_PREGEN_WINDOW_SECONDS)
+    # Tenants that sign up after the window get on-demand reports until next week
+    if now < window_end:
+        await seed_report_jobs(week)
+    # Jobs left running by a crashed process are picked up again
+    await db.report_jobs.update_many(
+        {"week": week, "status": "running", "started_at": {"$lt": now - timedelta(seconds=REPORT_STALE_JOB_SECONDS)}},
+        {"$set": {"status": "pending"}}
+    )
+    
+    pending = await db.report_jobs.find({"week": week, "status": "pending"}, {"_id": 0, "week": 1, "user_id": 1}).to_list(None)
+    if pending:
+        logging.info(f"Pre-generating {len(pending)} weekly reports for {week}")
+        semaphore = asyncio.Semaphore(REPORT_PREGEN_CONCURRENCY)
+        # Spread over what is left of the window; retries after it start right away
+        spacing = max((window_end - now).total_seconds(), 0) / len(pending)
+        tasks = []
+        for i, job in enumerate(pending):
+            if i:
+                await asyncio.sleep(spacing)
+            tasks.append(asyncio.create_task(run_report_job(job, semaphore, now)))
+        await asyncio.gather(*tasks)
+    
+    await purge_old_reports(now)
+
+async def run_report_pregeneration():
+    while True:
+        try:
+            now = datetime.now(timezone.utc)
+            if now >= report_pregen_start(now):
+                await pregenerate_weekly_reports(now)
+        except Exception as e:
+            logging.error(f"Error in weekly report pre-generation: {e}")
+        await asyncio.sleep(REPORT_PREGEN_CHECK_SECONDS)
+
+# ==================== BACKGROUND TASKS ====================
+
+async def run_analysis_loop():
     while True:
         try:
-            await scrape_threat_feeds()
-            await asyncio.sleep(10)
-            await analyze_with_llm()
-            await asyncio.sleep(300)
+            processed = await analyze_with_llm()
+            # Keep draining while there is a backlog, otherwise wait for new feed entries
+            await asyncio.sleep(5 if processed >= LLM_BATCH_SIZE else 300)
         except Exception as e:
             logging.error(f"Error in background tasks: {e}")
             await asyncio.sleep(60)
 
+async def run_background_tasks():
+    await asyncio.gather(run_feed_scheduler(), run_analysis_loop(), run_report_pregeneration())
+
+# ==================== DATABASE INDEXES ====================
+
+# (collection, keys, options) for every index a hot query relies on
+INDEX_SPECS = [
+    ("users", [("email", 1)], {"unique": True}),
+    ("users", [("id", 1)], {"unique": True}),
+    ("profiles", [("user_id", 1)], {"unique": True}),
+    ("attacks", [("id", 1)], {"unique": True}),
+    ("attacks", [("discovered_at", -1), ("id", -1)], {}),
+    # Array fields cannot share a compound index; each $or branch of attack_match_filter uses one
+    ("attacks", [("tags.industries", 1)], {}),
+    ("attacks", [("tags.regions", 1)], {}),
+    ("user_attacks", [("user_id", 1), ("attack_id", 1)], {"unique": True}),
+    ("user_attacks", [("user_id", 1), ("discovered_at", -1), ("id", -1)], {}),
+    # Prefixed by user_id so searches stay within one tenant's entries
+    ("user_attacks", [("user_id", 1), ("name", "text"), ("description", "text"), ("threat_actor", "text"),
+                      ("ttps", "text"), ("iocs", "text")], {
+        "name": "user_attacks_search",
+        "weights": {"name": 10, "threat_actor": 5, "ttps": 3, "iocs": 3, "description": 1},
+        "default_language": "english"
+    }),
+    ("yara_rules", [("attack_id", 1)], {}),
+    ("sigma_rules", [("attack_id", 1)], {}),
+    # Legacy rules predate template_version and may contain duplicates, so leave them out
+    ("yara_rules", [("attack_id", 1), ("template_version", 1)], {
+        "unique": True, "partialFilterExpression": {"template_version": {"$exists": True}}
+    }),
+    ("sigma_rules", [("attack_id", 1), ("template_version", 1)], {
+        "unique": True, "partialFilterExpression": {"template_version": {"$exists": True}}
+    }),
+    # Unique urls make concurrent scrapers safe against inserting duplicates
+    ("scraped_data", [("url", 1)], {"unique": True}),
+    ("scraped_data", [("processed", 1)], {}),
+    ("threat_intel", [("url", 1)], {"unique": True}),
+    ("threat_intel", [("published_at", -1)], {}),
+    ("threat_hunt_iocs", [("type", 1), ("value", 1)], {"unique": True}),
+    ("threat_hunt_iocs", [("created_at", -1), ("id", -1)], {}),
+    ("threat_hunt_queries", [("digest", 1)], {"unique": True}),
+    ("ioc_imports", [("id", 1)], {"unique": True}),
+    ("ioc_imports", [("started_at", -1)], {}),
+    ("threat_hunt_queries", [("generated_at", -1)], {}),
+    ("feed_state", [("source", 1)], {"unique": True}),
+    ("report_jobs", [("week", 1), ("user_id", 1)], {"unique": True}),
+    ("report_jobs", [("week", 1), ("status", 1)], {}),
+    ("report_jobs", [("created_at", 1)], {}),
+    ("weekly_reports.files", [("metadata.created_at", 1)], {}),
+    ("tenant_summary", [("user_id", 1)], {"unique": True}),
+    ("llm_analysis_cache", [("key", 1)], {"unique": True}),
+    ("llm_analysis_cache", [("last_used_at", 1)], {}),
+    ("llm_analysis_cache", [("created_at", 1)], {"expireAfterSeconds": LLM_CACHE_TTL_DAYS * 86400}),
+]
+
+# Representative filters and sorts for hot queries, checked for collection scans at startup
+HOT_QUERIES = [
+    ("users", {"email": ""}, None),
+    ("users", {"id": ""}, None),
+    ("profiles", {"user_id": ""}, None),
+    ("attacks", {"id": ""}, None),
+    ("attacks", {}, [("discovered_at", -1), ("id", -1)]),
+    ("user_attacks", {"user_id": ""}, [("discovered_at", -1), ("id", -1)]),
+    ("user_attacks", {"user_id": "", "attack_id": ""}, None),
+    ("yara_rules", {"attack_id": ""}, None),
+    ("sigma_rules", {"attack_id": ""}, None),
+    ("scraped_data", {"processed": False}, None),
+    ("scraped_data", {"url": {"$in": [""]}}, None),
+    ("threat_intel", {}, [("published_at", -1)]),
+    ("threat_hunt_iocs", {"type": "ip"}, None),
+    ("feed_state", {"source": ""}, None),
+    ("tenant_summary", {"user_id": ""}, None),
+]
+
+# Unique keys declared after data was written without them, so duplicates may already exist
+DEDUPLICATED_KEYS = [
+    ("user_attacks", ["user_id", "attack_id"]),
+    ("scraped_data", ["url"]),
+    ("threat_intel", ["url"]),
+]
+
+async def remove_duplicates(collection_name: str, keys: List[str]) -> List[dict]:
+    """Delete all but the first-inserted document per key; returns the keys that had duplicates"""
+    collection = db[collection_name]
+    index_key = [(key, 1) for key in keys]
+    for index in (await collection.index_information()).values():
+        if index.get("unique") and list(index["key"]) == index_key:
+            # The index already rules out duplicates
+            return []
+    
+    duplicated = []
+    removed = 0
+    async for group in collection.aggregate([
+        {"$group": {"_id": {key: f"${key}" for key in keys}, "keep": {"$min": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True):
+        result = await collection.delete_many({**group["_id"], "_id": {"$ne": group["keep"]}})
+        removed += result.deleted_count
+        duplicated.append(group["_id"])
+    if removed:
+        logging.info(f"{collection_name}: removed {removed} duplicate documents by {keys}")
+    return duplicated
+
+async def deduplicate_unique_keys():
+    """Clear duplicates that would stop ensure_indexes from building the unique indexes"""
+    for collection_name, keys in DEDUPLICATED_KEYS:
+        try:
+            duplicated = await remove_duplicates(collection_name, keys)
+        except Exception as e:
+            logging.error(f"Error removing duplicates from {collection_name}: {e}")
+            continue
+        if collection_name == "user_attacks" and duplicated:
+            # Summaries counted the extra links; they are rebuilt on next read
+            await db.tenant_summary.delete_many({"user_id": {"$in": list({key["user_id"] for key in duplicated})}})
+
+async def ensure_indexes():
+    """Create every declared index; existing indexes make this a no-op"""
+    for collection_name, keys, options in INDEX_SPECS:
+        try:
+            await db[collection_name].create_index(keys, **options)
+        except Exception as e:
+            logging.error(f"Could not create index {keys} on {collection_name}: {e}")
+
+def plan_has_collscan(plan) -> bool:
+    if isinstance(plan, dict):
+        if plan.get("stage") == "COLLSCAN":
+            return True
+        return any(plan_has_collscan(value) for value in plan.values())
+    if isinstance(plan, list):
+        return any(plan_has_collscan(value) for value in plan)
+    return False
+
+async def audit_query_plans():
+    """Log any hot query whose winning plan falls back to a collection scan"""
+    for collection_name, query, sort in HOT_QUERIES:
+        try:
+            cursor = db[collection_name].find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explanation = await cursor.explain()
+            if plan_has_collscan(explanation.get("queryPlanner", {}).get("winningPlan")):
+                logging.warning(f"Query on {collection_name} {query} sort={sort} uses a collection scan")
+        except Exception as e:
+            logging.error(f"Could not explain query on {collection_name}: {e}")
+
+# Fields that used to be stored as ISO strings, by collection
+DATETIME_FIELDS = {
+    "users": ["created_at"],
+    "profiles": ["created_at"],
+    "attacks": ["discovered_at"],
+    "user_attacks": ["discovered_at", "linked_at"],
+    "scraped_data": ["published_at"],
+    "threat_intel": ["published_at"],
+    "threat_hunt_iocs": ["created_at"],
+    "yara_rules": ["updated_at"],
+    "sigma_rules": ["updated_at"],
+    "feed_state": ["fetched_at"]
+}
+
+async def migrate_datetime_fields():
+    """Convert legacy ISO string timestamps to BSON dates; safe to run repeatedly"""
+    for collection_name, fields in DATETIME_FIELDS.items():
+        collection = db[collection_name]
+        migrated = 0
+        for field in fields:
+            while True:
+                docs = await collection.find({field: {"$type": "string"}}, {"_id": 1, field: 1}).limit(1000).to_list(1000)
+                if not docs:
+                    break
+                operations = []
+                for doc in docs:
+                    try:
+                        value = as_datetime(doc[field])
+                    except ValueError:
+                        logging.warning(f"Unparseable {collection_name}.{field} on {doc['_id']}: {doc[field]!r}")
+                        value = None
+                    operations.append(UpdateOne({"_id": doc["_id"]}, {"$set": {field: value}}))
+                await collection.bulk_write(operations, ordered=False)
+                migrated += len(operations)
+        if migrated:
+            logging.info(f"Migrated {migrated} timestamp fields in {collection_name} to BSON dates")
+            if collection_name == "user_attacks":
+                # Summaries built from string timestamps are rebuilt on next read
+                await db.tenant_summary.delete_many({})
+
 @app.on_event("startup")
 async def startup_event():
+    await normalize_stored_iocs()
+    await deduplicate_unique_keys()
+    await ensure_indexes()
+    asyncio.create_task(audit_query_plans())
+    await load_profile_tag_index()
+    await load_ioc_matcher()
+    # Summaries, reports and date range queries expect BSON dates, so this finishes before serving
+    await migrate_datetime_fields()
+    asyncio.create_task(backfill_link_search_fields())
+    asyncio.create_task(prune_detection_rules())
+    schedule_threat_hunt_refresh()
     asyncio.create_task(run_background_tasks())
 
 # ==================== ROOT & HEALTH CHECK ====================
@@ -1481,6 +2836,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 logging.basicConfig(
@@ -1491,4 +2847,8 @@ logger = logging.getLogger(__name__)
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+    client.close()
+    feed_parser_executor.shutdown(wait=False)
+    password_executor.shutdown(wait=False)
+    report_executor.shutdown(wait=False)
+    full_report_executor.shutdown(wait=False)
\ No newline at end of file
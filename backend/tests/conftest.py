@@ -0,0 +1,27 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+# server reads its configuration at import time
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "intellisecure_test")
+os.environ.setdefault("JWT_SECRET", "intellisecure-test-secret-key-with-enough-bytes")
+os.environ.setdefault("JWT_ALGORITHM", "HS256")
+os.environ.setdefault("JWT_EXPIRATION_HOURS", "24")
+
+@pytest.fixture
+def api(monkeypatch):
+    """The server module wired to an in-memory database, with background refreshes disabled"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    import server
+
+    db = mongomock_motor.AsyncMongoMockClient()["intellisecure_test"]
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "schedule_threat_hunt_refresh", lambda: None)
+    monkeypatch.setitem(server.ioc_matcher_state, "loaded_at", 0.0)
+    return server
@@ -0,0 +1,30 @@
+import asyncio
+
+def test_backfill_copies_search_fields_onto_legacy_links(api):
+    async def run():
+        await api.db.attacks.insert_many([
+            {"id": "attack-1", "name": "Attack 1", "ttps": ["T1566"], "iocs": ["evil.com"]},
+            {"id": "attack-2", "name": "Attack 2", "ttps": ["T1059"]},
+        ])
+        await api.db.user_attacks.insert_many([
+            {"id": "link-1", "user_id": "tenant-1", "attack_id": "attack-1"},
+            {"id": "link-2", "user_id": "tenant-2", "attack_id": "attack-1"},
+            {"id": "link-3", "user_id": "tenant-1", "attack_id": "attack-2"},
+            {"id": "link-4", "user_id": "tenant-1", "attack_id": "deleted-attack"},
+            {"id": "link-5", "user_id": "tenant-3", "attack_id": "attack-1", "ttps": ["edited"], "iocs": []},
+        ])
+        await api.backfill_link_search_fields()
+        # Running again finds nothing left to copy
+        await api.backfill_link_search_fields()
+        return {
+            link["id"]: (link.get("ttps"), link.get("iocs"))
+            async for link in api.db.user_attacks.find({}, {"_id": 0})
+        }
+
+    assert asyncio.run(run()) == {
+        "link-1": (["T1566"], ["evil.com"]),
+        "link-2": (["T1566"], ["evil.com"]),
+        "link-3": (["T1059"], []),
+        "link-4": ([], []),
+        "link-5": (["edited"], []),
+    }
@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+ATTACK = {
+    "id": "attack-1",
+    "name": "Loader Campaign",
+    "description": "Loader dropped via phishing",
+    "severity": "High",
+    "threat_actor": "APT X",
+    "source_url": "https://feeds.example/1",
+    "mitre_tactics": ["Initial Access"],
+    "ttps": ["T1566"],
+    "iocs": ["evil.example"]
+}
+
+def legacy_rules(count, now):
+    return [
+        {"id": f"legacy-{i}", "attack_id": ATTACK["id"], "rule_name": "Loader_Campaign_Yara",
+         "rule_content": f"rule legacy_{i} {{}}", "updated_at": now - timedelta(hours=i)}
+        for i in range(count)
+    ]
+
+def test_reads_return_one_rule_per_type_for_legacy_attacks(api):
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await api.ensure_indexes()
+        await api.db.attacks.insert_one(dict(ATTACK))
+        await api.db.yara_rules.insert_many(legacy_rules(30, now))
+        return await api.current_attack_rules(ATTACK["id"])
+
+    yara_rules, sigma_rules = asyncio.run(run())
+    assert len(yara_rules) == 1
+    assert len(sigma_rules) == 1
+    assert yara_rules[0]["template_version"] == sigma_rules[0]["template_version"] == api.RULE_TEMPLATE_VERSION
+
+def test_prune_keeps_latest_legacy_rule_and_drops_stale_versions(api):
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await api.ensure_indexes()
+        await api.db.yara_rules.insert_many(legacy_rules(5, now))
+        await api.db.yara_rules.insert_one({
+            "id": "old-version", "attack_id": "attack-2", "rule_content": "rule old {}",
+            "template_version": api.RULE_TEMPLATE_VERSION - 1
+        })
+        await api.prune_detection_rules()
+        return await api.db.yara_rules.find({}, {"_id": 0}).to_list(None)
+
+    remaining = asyncio.run(run())
+    assert [(rule["id"], rule["template_version"]) for rule in remaining] == [("legacy-0", api.RULE_TEMPLATE_VERSION)]
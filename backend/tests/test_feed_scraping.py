@@ -0,0 +1,85 @@
+import asyncio
+
+from aiohttp import web
+
+FEED = b"""<?xml version="1.0"?>
+<rss version="2.0"><channel><title>Advisories</title>
+<item><title>Advisory one</title><link>https://feeds.example/1</link><description>first</description>
+<pubDate>Mon, 06 Oct 2025 10:00:00 GMT</pubDate></item>
+<item><title>Advisory two</title><link>https://feeds.example/2</link><description>second</description>
+<pubDate>Tue, 07 Oct 2025 10:00:00 GMT</pubDate></item>
+</channel></rss>"""
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get("/feed", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/feed"
+
+async def scrape(server, handler):
+    import aiohttp
+    runner, url = await serve(handler)
+    try:
+        async with aiohttp.ClientSession() as session:
+            return url, await server.scrape_source(session, url, asyncio.Semaphore(1))
+    finally:
+        await runner.cleanup()
+
+def test_http_error_is_a_failed_scrape(api):
+    async def gone(request):
+        return web.Response(status=404, text="retired")
+
+    _, result = asyncio.run(scrape(api, gone))
+    assert result["ok"] is False
+    assert "404" in result["error"]
+
+def test_feed_entries_are_stored(api):
+    async def feed(request):
+        return web.Response(body=FEED, content_type="application/rss+xml", headers={"ETag": '"v1"'})
+
+    async def run():
+        url, result = await scrape(api, feed)
+        stored = await api.db.scraped_data.count_documents({"source": url})
+        return result, stored
+
+    result, stored = asyncio.run(run())
+    assert result["ok"] is True
+    assert result["new_entries"] == 2
+    assert stored == 2
+
+def test_validators_saved_only_after_entries_are_stored(api, monkeypatch):
+    requests_seen = []
+
+    async def feed(request):
+        requests_seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.Response(body=FEED, content_type="application/rss+xml", headers={"ETag": '"v1"'})
+
+    async def failing_store(source, entries):
+        raise RuntimeError("mongo unavailable")
+
+    async def run():
+        runner, url = await serve(feed)
+        try:
+            import aiohttp
+            async with aiohttp.ClientSession() as session:
+                with monkeypatch.context() as patch:
+                    patch.setattr(api, "store_feed_entries", failing_store)
+                    failed = await api.scrape_source(session, url, asyncio.Semaphore(1))
+                retried = await api.scrape_source(session, url, asyncio.Semaphore(1))
+                unchanged = await api.scrape_source(session, url, asyncio.Semaphore(1))
+        finally:
+            await runner.cleanup()
+        return failed, retried, unchanged
+
+    failed, retried, unchanged = asyncio.run(run())
+    assert failed["ok"] is False
+    # The failed cycle did not record the ETag, so the retry downloads and stores the entries
+    assert retried["new_entries"] == 2
+    assert unchanged["new_entries"] == 0
+    assert requests_seen == [None, None, '"v1"']
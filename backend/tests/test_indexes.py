@@ -0,0 +1,54 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+def link(link_id, user_id, attack_id, discovered_at):
+    return {
+        "id": link_id, "user_id": user_id, "attack_id": attack_id,
+        "name": attack_id, "severity": "High", "discovered_at": discovered_at
+    }
+
+def test_duplicate_links_are_removed_before_the_unique_index(api):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def run():
+        await api.db.user_attacks.insert_many([
+            link("link-1", "tenant-1", "attack-1", now),
+            link("link-2", "tenant-1", "attack-1", now),
+            link("link-3", "tenant-1", "attack-2", now - timedelta(days=1)),
+            link("link-4", "tenant-2", "attack-1", now),
+        ])
+        await api.db.tenant_summary.insert_many([
+            {"user_id": "tenant-1", "total": 3},
+            {"user_id": "tenant-2", "total": 1},
+        ])
+        await api.deduplicate_unique_keys()
+        await api.ensure_indexes()
+        # Once the index exists there is nothing left to scan for
+        assert await api.remove_duplicates("user_attacks", ["user_id", "attack_id"]) == []
+        ids = sorted([doc["id"] async for doc in api.db.user_attacks.find({}, {"id": 1})])
+        indexes = await api.db.user_attacks.index_information()
+        untouched = await api.db.tenant_summary.find_one({"user_id": "tenant-2"}, {"_id": 0})
+        return ids, indexes, untouched, await api.get_tenant_summary("tenant-1")
+
+    ids, indexes, untouched, summary = asyncio.run(run())
+    assert ids == ["link-1", "link-3", "link-4"]
+    assert any(index.get("unique") and index["key"] == [("user_id", 1), ("attack_id", 1)] for index in indexes.values())
+    assert untouched == {"user_id": "tenant-2", "total": 1}
+    assert summary["total"] == 2
+
+def test_duplicate_feed_urls_are_removed_before_the_unique_index(api):
+    async def run():
+        for collection in (api.db.scraped_data, api.db.threat_intel):
+            await collection.insert_many([
+                {"id": "entry-1", "url": "https://news.example.com/a"},
+                {"id": "entry-2", "url": "https://news.example.com/a"},
+                {"id": "entry-3", "url": "https://news.example.com/b"},
+            ])
+        await api.deduplicate_unique_keys()
+        await api.ensure_indexes()
+        return [
+            sorted([doc["id"] async for doc in collection.find({}, {"id": 1})])
+            for collection in (api.db.scraped_data, api.db.threat_intel)
+        ]
+
+    assert asyncio.run(run()) == [["entry-1", "entry-3"], ["entry-1", "entry-3"]]
@@ -0,0 +1,171 @@
+import asyncio
+import json
+
+import httpx
+
+def user_headers(server):
+    return {"Authorization": f"Bearer {server.create_jwt_token('user-1', 'analyst@example.com')}"}
+
+def body_chunks(lines, lines_per_chunk=500):
+    async def chunks():
+        for i in range(0, len(lines), lines_per_chunk):
+            yield "".join(lines[i:i + lines_per_chunk]).encode('utf-8')
+    return chunks()
+
+async def post(server, path, content, headers):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        # A request body lost to the response stream shows up as a hang, not an error
+        return await asyncio.wait_for(client.post(path, content=content, headers=headers), timeout=30)
+
+def ndjson(response):
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+def test_scan_reads_every_streamed_line(api):
+    async def run():
+        await api.db.threat_hunt_iocs.insert_many([
+            {"type": "ip", "value": "10.0.0.0/8"},
+            {"type": "domain", "value": "evil.com"}
+        ])
+        lines = [f"src=10.1.2.{i % 250} dst=192.168.0.1 host=cdn.example.org\n" for i in range(5000)]
+        lines[1234] = "GET http://updates.evil.com/payload from 172.16.0.1\n"
+        return await post(api, "/api/dashboard/threat-hunt/scan", body_chunks(lines), user_headers(api))
+
+    response = asyncio.run(run())
+    assert response.status_code == 200
+    records = ndjson(response)
+    assert records[-1]["summary"] == {"lines": 5000, "matched_lines": 5000, "indicators": 2}
+    domain_hit = next(record for record in records if record.get("line") == 1235)
+    assert {"type": "domain", "ioc": "evil.com", "value": "updates.evil.com"} in domain_hit["matches"]
+
+def test_scan_ndjson_records(api):
+    async def run():
+        await api.db.threat_hunt_iocs.insert_one({"type": "hash", "value": "d41d8cd98f00b204e9800998ecf8427e"})
+        lines = [
+            json.dumps({"event": "file_write", "file": {"md5": "D41D8CD98F00B204E9800998ECF8427E"}}) + "\n",
+            json.dumps({"event": "file_write", "file": {"md5": "0" * 32}}) + "\n",
+            "not json at all\n"
+        ]
+        return await post(api, "/api/dashboard/threat-hunt/scan?format=ndjson", body_chunks(lines, 1), user_headers(api))
+
+    records = ndjson(asyncio.run(run()))
+    assert records[0] == {"line": 1, "matches": [
+        {"type": "hash", "ioc": "d41d8cd98f00b204e9800998ecf8427e", "value": "D41D8CD98F00B204E9800998ECF8427E"}
+    ]}
+    assert records[-1]["summary"]["lines"] == 3
+    assert records[-1]["summary"]["matched_lines"] == 1
+
+def test_scan_rejects_unknown_format(api):
+    response = asyncio.run(post(api, "/api/dashboard/threat-hunt/scan?format=xml", b"", user_headers(api)))
+    assert response.status_code == 400
+
+def admin_headers(server):
+    return {"Authorization": f"Bearer {server.create_jwt_token('admin', 'admin')}"}
+
+def import_iocs(server, input_format, lines, existing=()):
+    async def run():
+        await server.ensure_indexes()
+        if existing:
+            await server.db.threat_hunt_iocs.insert_many([dict(ioc) for ioc in existing])
+        response = await post(
+            server, f"/api/admin/threat-hunt-iocs/import?format={input_format}&source=feed-x",
+            body_chunks(lines, 100), admin_headers(server)
+        )
+        stored = await server.db.threat_hunt_iocs.find({}, {"_id": 0}).to_list(None)
+        ioc_import = await server.db.ioc_imports.find_one({}, {"_id": 0})
+        return response, stored, ioc_import
+    return asyncio.run(run())
+
+def test_ndjson_import_normalizes_and_dedups(api):
+    lines = [json.dumps({"type": "domain", "value": f"Host{i}.Example.ORG."}) + "\n" for i in range(2500)]
+    lines += [
+        json.dumps({"value": "2001:DB8::1"}) + "\n",
+        json.dumps({"type": "hash", "value": "D41D8CD98F00B204E9800998ECF8427E"}) + "\n",
+        json.dumps({"type": "domain", "value": "host7.example.org"}) + "\n",
+        json.dumps({"type": "ip", "value": "not-an-ip"}) + "\n",
+        "{broken\n"
+    ]
+    existing = [{"id": "old", "type": "domain", "value": "host1.example.org"}]
+    response, stored, ioc_import = import_iocs(api, "ndjson", lines, existing)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["status"] == "done"
+    assert result["processed"] == 2505
+    assert result["inserted"] == 2501
+    assert result["duplicates"] == 2
+    assert result["invalid"] == 2
+    assert len(stored) == 2502
+
+    by_value = {ioc["value"]: ioc for ioc in stored}
+    assert "host2499.example.org" in by_value
+    assert by_value["2001:db8::1"]["type"] == "ip"
+    assert by_value["d41d8cd98f00b204e9800998ecf8427e"]["hash_type"] == "md5"
+    assert by_value["host2.example.org"]["source"] == "feed-x"
+    assert ioc_import["status"] == "done"
+    assert ioc_import["inserted"] == 2501
+
+    # The matcher is rebuilt from the imported set
+    assert api.ioc_matcher_state["matcher"].match_text("GET http://cdn.host42.example.org/")
+
+def test_csv_import_with_and_without_header(api):
+    response, stored, _ = import_iocs(api, "csv", [
+        "Type,Value,Description\n",
+        "ip,10.0.0.0/8,internal range\n",
+        "url,HTTP://Evil.COM/Payload,\"dropper, stage 1\"\n"
+    ])
+    assert response.json()["inserted"] == 2
+    by_value = {ioc["value"]: ioc for ioc in stored}
+    assert by_value["10.0.0.0/8"]["description"] == "internal range"
+    assert by_value["http://evil.com/Payload"]["description"] == "dropper, stage 1"
+
+def test_csv_import_positional_columns(api):
+    response, stored, _ = import_iocs(api, "csv", ["203.0.113.5\n", "evil.example,domain\n"])
+    assert response.json()["inserted"] == 2
+    assert {(ioc["type"], ioc["value"]) for ioc in stored} == {("ip", "203.0.113.5"), ("domain", "evil.example")}
+
+def test_stix_bundle_import(api):
+    bundle = {
+        "type": "bundle",
+        "objects": [
+            {"type": "indicator", "name": "C2", "pattern": "[ipv4-addr:value = '198.51.100.7'] OR [domain-name:value = 'C2.Example.net']"},
+            {"type": "indicator", "pattern": "[file:hashes.'SHA-256' = '" + "AB" * 32 + "']"},
+            {"type": "url", "value": "https://phish.example.com/login"},
+            {"type": "malware", "name": "ignored"}
+        ]
+    }
+    response, stored, _ = import_iocs(api, "stix", [json.dumps(bundle)])
+    assert response.json()["inserted"] == 4
+    assert {(ioc["type"], ioc["value"]) for ioc in stored} == {
+        ("ip", "198.51.100.7"),
+        ("domain", "c2.example.net"),
+        ("hash", "ab" * 32),
+        ("url", "https://phish.example.com/login")
+    }
+
+def test_invalid_stix_bundle_is_rejected(api):
+    response, stored, ioc_import = import_iocs(api, "stix", ["{not json"])
+    assert response.status_code == 400
+    assert stored == []
+    assert ioc_import["status"] == "failed"
+
+def test_ioc_list_is_paged_with_full_stats(api):
+    async def run():
+        importer = api.IOCImporter()
+        for i in range(230):
+            importer.add({"type": "domain" if i % 2 else "ip", "value": f"host{i}.example.org" if i % 2 else f"10.0.{i}.1"})
+        await importer.finish()
+        transport = httpx.ASGITransport(app=api.app)
+        pages = []
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            skip = 0
+            while skip is not None:
+                response = await client.get(f"/api/admin/threat-hunt-iocs?skip={skip}", headers=admin_headers(api))
+                pages.append(response.json())
+                skip = pages[-1]["next_skip"]
+        return pages
+
+    pages = asyncio.run(run())
+    assert [len(page["iocs"]) for page in pages] == [100, 100, 30]
+    assert len({ioc["id"] for page in pages for ioc in page["iocs"]}) == 230
+    assert pages[0]["stats"] == {"total": 230, "ips": 115, "domains": 115, "hashes": 0, "urls": 0, "emails": 0}
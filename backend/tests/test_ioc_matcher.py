@@ -0,0 +1,122 @@
+import pytest
+
+from ioc_matcher import (
+    build_matcher, detect_ioc_type, hash_type, normalize_ioc, stix_indicators
+)
+
+@pytest.mark.parametrize("ioc_type,value,expected", [
+    ("domain", "  WWW.Evil.COM. ", "www.evil.com"),
+    ("domain", "*.evil.com", "evil.com"),
+    ("domain", "localhost", None),
+    ("ip", "192.168.1.10", "192.168.1.10"),
+    ("ip", "2001:DB8:0:0::1", "2001:db8::1"),
+    ("ip", "10.1.2.3/8", "10.0.0.0/8"),
+    ("ip", "10.1.2", None),
+    ("ip", "010.1.2.3", None),
+    ("hash", "D41D8CD98F00B204E9800998ECF8427E", "d41d8cd98f00b204e9800998ecf8427e"),
+    ("hash", "xyz", None),
+    ("hash", "g" * 32, None),
+    ("url", "HTTP://Evil.COM/Path/", "http://evil.com/Path"),
+    ("url", "evil.com/dl", "http://evil.com/dl"),
+    ("email", "Phish@Evil.COM", "phish@evil.com"),
+    ("email", "not-an-email", None),
+    ("unknown", "value", None),
+])
+def test_normalize_ioc(ioc_type, value, expected):
+    assert normalize_ioc(ioc_type, value) == expected
+
+@pytest.mark.parametrize("value,expected", [
+    ("https://evil.com/x", "url"),
+    ("a@evil.com", "email"),
+    ("203.0.113.9", "ip"),
+    ("203.0.113.0/24", "ip"),
+    ("e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855", "hash"),
+    ("Evil.com", "domain"),
+    ("nonsense", None),
+])
+def test_detect_ioc_type(value, expected):
+    assert detect_ioc_type(value) == expected
+
+def test_hash_type_by_length():
+    assert [hash_type("a" * n) for n in (32, 40, 64, 128, 12)] == ["md5", "sha1", "sha256", "sha512", None]
+
+def hits(matcher, text):
+    return [(match["type"], match["ioc"]) for match in matcher.match_text(text)]
+
+@pytest.fixture
+def matcher():
+    return build_matcher([
+        {"type": "ip", "value": "10.0.0.0/8"},
+        {"type": "ip", "value": "45.0.0.0/8"},
+        {"type": "ip", "value": "0.0.4.210"},
+        {"type": "ip", "value": "198.51.100.7"},
+        {"type": "ip", "value": "2001:db8::/32"},
+        {"type": "ip", "value": "::1"},
+        {"type": "domain", "value": "Evil.com"},
+        {"type": "hash", "value": "D41D8CD98F00B204E9800998ECF8427E"},
+        {"type": "url", "value": "http://bad.org/dropper"},
+        {"type": "email", "value": "ceo@phish.net"},
+    ])
+
+@pytest.mark.parametrize("text,expected", [
+    ("DENY src=198.51.100.7 dst=192.0.2.1", [("ip", "198.51.100.7")]),
+    ("ALLOW 10.20.30.40:8080 -> 192.0.2.1:443", [("ip", "10.0.0.0/8")]),
+    ("conn [2001:db8::5]:443 closed", [("ip", "2001:db8::/32")]),
+    ("ssh from [::1]:22", [("ip", "::1")]),
+    ("CONNECT cdn.EVIL.com:443 HTTP/1.1", [("domain", "evil.com")]),
+    ("resolved evil.com.example.org", []),
+    ("notevil.com", []),
+    ("sha d41d8cd98f00b204e9800998ecf8427e", [("hash", "d41d8cd98f00b204e9800998ecf8427e")]),
+    ("MD5=D41D8CD98F00B204E9800998ECF8427E", [("hash", "d41d8cd98f00b204e9800998ecf8427e")]),
+    ("GET http://bad.org/dropper/ 200", [("url", "http://bad.org/dropper")]),
+    ("GET http://bad.org/dropper?id=1#top 200", [("url", "http://bad.org/dropper")]),
+    ("GET https://BAD.org:443/dropper/stage2.bin", [("url", "http://bad.org/dropper")]),
+    ("GET http://bad.org/dropper2", []),
+    ("GET http://bad.org/ 200", []),
+    ("mail from CEO@phish.net", [("email", "ceo@phish.net")]),
+    # Version strings and plain integers are not short-form IPv4 addresses
+    ("agent version 45.3 build 1234", []),
+    ("octal 010.1.2.3", []),
+])
+def test_match_text(matcher, text, expected):
+    assert hits(matcher, text) == expected
+
+def test_remove_keeps_duplicates_until_last_copy(matcher):
+    matcher.add("domain", "evil.com")
+    matcher.remove("domain", "EVIL.com")
+    assert hits(matcher, "evil.com") == [("domain", "evil.com")]
+    matcher.remove("domain", "evil.com")
+    assert hits(matcher, "evil.com") == []
+
+    matcher.remove("ip", "10.0.0.0/8")
+    assert hits(matcher, "10.1.1.1:80") == []
+
+def test_url_iocs_match_by_host_and_path_prefix():
+    matcher = build_matcher([
+        {"type": "url", "value": "evil.com/payload.exe"},
+        {"type": "url", "value": "https://cdn.evil.com"},
+        {"type": "url", "value": "http://evil.com/gate.php?id=5"},
+    ])
+    assert hits(matcher, "GET https://evil.com/payload.exe?id=1") == [("url", "http://evil.com/payload.exe")]
+    assert hits(matcher, "fetch https://cdn.evil.com/js/app.js") == [("url", "https://cdn.evil.com")]
+    assert hits(matcher, "POST http://evil.com/gate.php?id=7") == [("url", "http://evil.com/gate.php?id=5")]
+    assert hits(matcher, "GET http://evil.com/index.html") == []
+
+    matcher.remove("url", "https://cdn.evil.com/")
+    assert hits(matcher, "fetch https://cdn.evil.com/js/app.js") == []
+    assert matcher.urls.keys() == {"evil.com"}
+
+def test_stix_indicators_patterns_and_observables():
+    bundle = {"objects": [
+        {"type": "indicator", "name": "C2", "pattern": "[ipv4-addr:value = '1.2.3.4'] OR [file:hashes.MD5 = 'abc']"},
+        {"type": "indicator", "pattern": "[file:name = 'evil.exe']"},
+        {"type": "email-addr", "value": "x@evil.com"},
+        {"type": "file", "hashes": {"SHA-1": "a" * 40}},
+        "not an object",
+    ]}
+    assert [(ioc["type"], ioc["value"]) for ioc in stix_indicators(bundle)] == [
+        ("ip", "1.2.3.4"),
+        ("hash", "abc"),
+        ("email", "x@evil.com"),
+        ("hash", "a" * 40),
+    ]
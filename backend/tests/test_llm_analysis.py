@@ -0,0 +1,44 @@
+import asyncio
+
+from pymongo.errors import ServerSelectionTimeoutError
+
+class FailingUpdates:
+    """Collection whose update_one fails as it would during a Mongo outage"""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def update_one(self, *args, **kwargs):
+        raise ServerSelectionTimeoutError("No servers available")
+
+class Database:
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        collection = getattr(self.db, name)
+        return FailingUpdates(collection) if name == "scraped_data" else collection
+
+def test_failed_processed_update_does_not_stall_the_batch(api, monkeypatch):
+    async def no_analysis(*args):
+        return None
+
+    monkeypatch.setattr(api, "get_cached_analysis", no_analysis)
+    monkeypatch.setattr(api, "request_llm_analysis", no_analysis)
+    monkeypatch.setattr(api, "LLM_CONCURRENCY", 2)
+    articles = [{"id": f"article-{i}", "title": f"Article {i}", "content": "text", "processed": False} for i in range(5)]
+
+    async def run():
+        await api.db.scraped_data.insert_many([dict(article) for article in articles])
+        monkeypatch.setattr(api, "db", Database(api.db))
+        processed = await asyncio.wait_for(api.analyze_with_llm(), timeout=10)
+        unprocessed = await api.db.scraped_data.count_documents({"processed": False})
+        return processed, unprocessed
+
+    processed, unprocessed = asyncio.run(run())
+    assert processed == 5
+    # Left for the next batch to retry
+    assert unprocessed == 5
@@ -0,0 +1,59 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+def link(user_id, index, severity, discovered_at):
+    return {
+        "id": f"link-{index}",
+        "user_id": user_id,
+        "attack_id": f"attack-{index}",
+        "name": f"Attack {index}",
+        "severity": severity,
+        "threat_actor": "APT.X",
+        "discovered_at": discovered_at
+    }
+
+def test_new_link_does_not_replace_missing_summary(api):
+    """Tenants whose links predate tenant_summary must get a full rebuild, not a one-link summary"""
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def run():
+        await api.db.user_attacks.insert_many([
+            link("tenant-1", i, severity, now - timedelta(days=i + 1))
+            for i, severity in enumerate(["High", "High", "Critical"])
+        ])
+        await api.write_user_attack_links([link("tenant-1", 9, "Low", now)])
+        return await api.get_tenant_summary("tenant-1")
+
+    summary = asyncio.run(run())
+    assert summary["total"] == 4
+    assert summary["severity"] == {"High": 2, "Critical": 1, "Low": 1}
+    assert summary["threat_actors"] == {"APT．X": 4}
+    assert [entry["id"] for entry in summary["recent"]] == ["link-9", "link-0", "link-1", "link-2"]
+
+def test_existing_summary_is_incremented(api):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def run():
+        await api.db.user_attacks.insert_one(link("tenant-2", 1, "High", now - timedelta(days=1)))
+        await api.get_tenant_summary("tenant-2")
+        await api.write_user_attack_links([link("tenant-2", 2, "Medium", now)])
+        return await api.get_tenant_summary("tenant-2")
+
+    summary = asyncio.run(run())
+    assert summary["total"] == 2
+    assert summary["severity"] == {"High": 1, "Medium": 1}
+    assert summary["recent"][0]["id"] == "link-2"
+
+def test_rebuild_skips_legacy_string_dates_in_daily_counts(api):
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+
+    async def run():
+        await api.db.user_attacks.insert_many([
+            link("tenant-3", 1, "High", now),
+            link("tenant-3", 2, "Low", (now - timedelta(days=1)).isoformat())
+        ])
+        return await api.rebuild_tenant_summary("tenant-3")
+
+    summary = asyncio.run(run())
+    assert summary["total"] == 2
+    assert summary["daily"] == {now.strftime("%Y-%m-%d"): 1}
@@ -0,0 +1,64 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+PROFILE = {"user_id": "user-1", "company_name": "Acme", "industry": "Finance", "region": "EU"}
+
+async def get_report(server):
+    headers = {"Authorization": f"Bearer {server.create_jwt_token('user-1', 'analyst@example.com')}"}
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+        return await asyncio.wait_for(client.get("/api/dashboard/weekly-report", headers=headers), timeout=30)
+
+def serve_stub_reports(server, monkeypatch):
+    async def stream_report_file(file_id):
+        yield b"pregenerated"
+
+    async def build_weekly_report(profile, now):
+        return b"on-demand"
+
+    monkeypatch.setattr(server, "stream_report_file", stream_report_file)
+    monkeypatch.setattr(server, "build_weekly_report", build_weekly_report)
+    server.weekly_report_cache.clear()
+
+def test_jobs_are_only_seeded_in_the_start_window(api, monkeypatch):
+    async def purge_old_reports(now):
+        pass
+
+    monkeypatch.setattr(api, "purge_old_reports", purge_old_reports)
+    monday = datetime(2026, 10, 12, api.REPORT_PREGEN_START_HOUR, tzinfo=timezone.utc)
+
+    async def run():
+        await api.db.profiles.insert_one(dict(PROFILE))
+        await api.pregenerate_weekly_reports(monday + timedelta(days=2))
+        return await api.db.report_jobs.count_documents({})
+
+    assert asyncio.run(run()) == 0
+
+def test_pregenerated_report_is_served_until_new_links_arrive(api, monkeypatch):
+    serve_stub_reports(api, monkeypatch)
+    now = datetime.now(timezone.utc)
+
+    async def run():
+        await api.db.profiles.insert_one(dict(PROFILE))
+        await api.get_tenant_summary("user-1")
+        # Stored dates keep millisecond precision
+        await asyncio.sleep(0.01)
+        await api.db.report_jobs.insert_one({
+            "week": api.report_week(now), "user_id": "user-1", "status": "done",
+            "file_id": "file-1", "rendered_at": datetime.now(timezone.utc)
+        })
+        before = await get_report(api)
+        await api.db.user_attacks.insert_one({
+            "id": "link-1", "user_id": "user-1", "attack_id": "attack-1", "name": "Attack 1",
+            "severity": "High", "discovered_at": datetime.now(timezone.utc) + timedelta(seconds=1)
+        })
+        await asyncio.sleep(0.01)
+        await api.rebuild_tenant_summary("user-1")
+        after = await get_report(api)
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert before.content == b"pregenerated"
+    assert after.content == b"on-demand"
@@ -9,6 +9,7 @@ class IntelliSecureAPITester:
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.token = None
+        self.admin_token = None
         self.user_id = None
         self.tests_run = 0
         self.tests_passed = 0
@@ -202,6 +203,158 @@ class IntelliSecureAPITester:
         
         return success1 and success2
 
+    def test_cursor_pagination(self):
+        """Test keyset pagination through the X-Next-Cursor header"""
+        print("\n🔍 Testing Cursor Pagination...")
+        
+        if not self.token:
+            self.log_test("Cursor Pagination Test", False, "No auth token available")
+            return False
+        
+        headers = {'Authorization': f'Bearer {self.token}'}
+        try:
+            seen_ids = []
+            cursor = None
+            for _ in range(3):
+                params = {"limit": 1}
+                if cursor:
+                    params["cursor"] = cursor
+                response = requests.get(f"{self.api_url}/dashboard/timeline", params=params, headers=headers, timeout=30)
+                if response.status_code != 200:
+                    self.log_test("Cursor Pagination", False, f"Status: {response.status_code}")
+                    return False
+                page = response.json()
+                if len(page) > 1:
+                    self.log_test("Cursor Pagination", False, f"Page size {len(page)} exceeds limit 1")
+                    return False
+                seen_ids.extend(item.get("id") for item in page)
+                cursor = response.headers.get("X-Next-Cursor")
+                if not cursor:
+                    break
+            
+            success = len(seen_ids) == len(set(seen_ids))
+            self.log_test("Cursor Pagination", success, f"Pages returned ids {seen_ids}")
+            
+            response = requests.get(f"{self.api_url}/dashboard/attacks", params={"cursor": "not-a-cursor"}, headers=headers, timeout=30)
+            self.log_test("Invalid Cursor Rejected", response.status_code == 400, f"Status: {response.status_code}")
+            return success
+        except Exception as e:
+            self.log_test("Cursor Pagination", False, f"Exception: {str(e)}")
+            return False
+
+    def test_threat_hunt_scan(self):
+        """Test scanning streamed log lines against the curated IOCs"""
+        print("\n🔍 Testing Threat Hunt Log Scan...")
+        
+        if not self.token:
+            self.log_test("Threat Hunt Scan Test", False, "No auth token available")
+            return False
+        
+        headers = {'Authorization': f'Bearer {self.token}', 'Content-Type': 'text/plain'}
+        lines = "".join(f"src=10.0.0.{i % 250} dst=198.51.100.{i % 250}:443 host=example.org\n" for i in range(1000))
+        try:
+            response = requests.post(f"{self.api_url}/dashboard/threat-hunt/scan", data=lines, headers=headers, timeout=60)
+            if response.status_code != 200:
+                self.log_test("Threat Hunt Scan", False, f"Status: {response.status_code}")
+                return False
+            summary = json.loads(response.text.strip().splitlines()[-1]).get("summary", {})
+            success = summary.get("lines") == 1000
+            self.log_test("Threat Hunt Scan", success, f"Summary: {summary}")
+            return success
+        except Exception as e:
+            self.log_test("Threat Hunt Scan", False, f"Exception: {str(e)}")
+            return False
+
+    def test_admin_login(self, username="admin", password="Aarrafj7##7jfarraA"):
+        """Log in as admin for the admin endpoint tests"""
+        print("\n🔍 Testing Admin Login...")
+        
+        success, response = self.run_test(
+            "Admin Login",
+            "POST",
+            "admin/login",
+            200,
+            data={"username": username, "password": password},
+            auth_required=False
+        )
+        if success and 'token' in response:
+            self.admin_token = response['token']
+        return success
+
+    def test_ioc_import(self):
+        """Test streaming an NDJSON IOC import and reading back its progress record"""
+        print("\n🔍 Testing IOC Import...")
+        
+        if not self.admin_token:
+            self.log_test("IOC Import Test", False, "No admin token available")
+            return False
+        
+        headers = {'Authorization': f'Bearer {self.admin_token}', 'Content-Type': 'application/x-ndjson'}
+        stamp = datetime.now().strftime('%H%M%S%f')
+        lines = "".join(json.dumps({"type": "domain", "value": f"Import-{stamp}-{i}.Example.org"}) + "\n" for i in range(100))
+        try:
+            response = requests.post(f"{self.api_url}/admin/threat-hunt-iocs/import?format=ndjson&source=backend_test",
+                                     data=lines, headers=headers, timeout=60)
+            result = response.json() if response.status_code == 200 else {}
+            success = result.get("processed") == 100 and result.get("inserted") == 100
+            self.log_test("IOC Import", success, f"Status: {response.status_code}, Result: {result}")
+            
+            response = requests.get(f"{self.api_url}/admin/threat-hunt-iocs/imports/{result.get('id')}",
+                                    headers=headers, timeout=30)
+            recorded = response.json() if response.status_code == 200 else {}
+            self.log_test("IOC Import Progress Record", recorded.get("status") == "done", f"Record: {recorded}")
+            return success
+        except Exception as e:
+            self.log_test("IOC Import", False, f"Exception: {str(e)}")
+            return False
+
+    def test_tenant_summary_rebuild(self):
+        """Test that rebuilding a tenant summary leaves the dashboard stats unchanged"""
+        print("\n🔍 Testing Tenant Summary Rebuild...")
+        
+        if not self.admin_token or not self.token or not self.user_id:
+            self.log_test("Tenant Summary Rebuild Test", False, "Missing user or admin token")
+            return False
+        
+        user_headers = {'Authorization': f'Bearer {self.token}'}
+        admin_headers = {'Authorization': f'Bearer {self.admin_token}'}
+        try:
+            before = requests.get(f"{self.api_url}/dashboard/stats", headers=user_headers, timeout=30).json()
+            response = requests.post(f"{self.api_url}/admin/tenant-summaries/rebuild",
+                                     params={"user_id": self.user_id}, headers=admin_headers, timeout=60)
+            if response.status_code != 200:
+                self.log_test("Tenant Summary Rebuild", False, f"Status: {response.status_code}")
+                return False
+            after = requests.get(f"{self.api_url}/dashboard/stats", headers=user_headers, timeout=30).json()
+            success = before.get("total_threats") == after.get("total_threats")
+            self.log_test("Tenant Summary Rebuild", success, f"Before: {before}, After: {after}")
+            return success
+        except Exception as e:
+            self.log_test("Tenant Summary Rebuild", False, f"Exception: {str(e)}")
+            return False
+
+    def test_admin_monitoring(self):
+        """Test the feed health and LLM cache monitoring endpoints"""
+        print("\n🔍 Testing Admin Monitoring Endpoints...")
+        
+        if not self.admin_token:
+            self.log_test("Admin Monitoring Test", False, "No admin token available")
+            return False
+        
+        user_token = self.token
+        self.token = self.admin_token
+        success, health = self.run_test("Feed Source Health", "GET", "admin/resources/health", 200)
+        if success:
+            sources = health.get("sources", [])
+            fields_present = all("next_run_in_seconds" in source for source in sources)
+            self.log_test("Feed Source Health Fields", bool(sources) and fields_present, f"{len(sources)} sources")
+        cache_success, cache = self.run_test("LLM Cache Stats", "GET", "admin/llm-cache", 200)
+        if cache_success:
+            fields_present = all(field in cache for field in ("hits", "misses", "hit_rate", "entries", "prompt_version"))
+            self.log_test("LLM Cache Stats Fields", fields_present, f"hit rate {cache.get('hit_rate')}")
+        self.token = user_token
+        return success and cache_success
+
     def test_insights_endpoint(self):
         """Test insights endpoint"""
         print("\n🔍 Testing Insights Endpoint...")
@@ -275,8 +428,16 @@ class IntelliSecureAPITester:
             # Test protected endpoints
             self.test_profile_endpoints()
             self.test_dashboard_endpoints()
+            self.test_cursor_pagination()
+            self.test_threat_hunt_scan()
             self.test_rules_endpoint()
         
+        # Test admin endpoints
+        if self.test_admin_login():
+            self.test_admin_monitoring()
+            self.test_ioc_import()
+            self.test_tenant_summary_rebuild()
+        
         # Test public endpoints
         self.test_insights_endpoint()
         
@@ -26,6 +26,7 @@ const AdminDashboard = () => {
   const [sigmaTTPs, setSigmaTTPs] = useState(['']);
   const [threatHuntIOCs, setThreatHuntIOCs] = useState([]);
   const [iocStats, setIocStats] = useState({});
+  const [iocNextSkip, setIocNextSkip] = useState(null);
   const [newIOC, setNewIOC] = useState({ type: 'ip', value: '', description: '', source: '' });
 
   useEffect(() => {
@@ -51,6 +52,7 @@ const AdminDashboard = () => {
       setAttacks(attacksRes.data);
       setThreatHuntIOCs(iocsRes.data.iocs);
       setIocStats(iocsRes.data.stats);
+      setIocNextSkip(iocsRes.data.next_skip);
     } catch (error) {
       if (error.response?.status === 401 || error.response?.status === 403) {
         localStorage.removeItem('admin_token');
@@ -159,6 +161,21 @@ const AdminDashboard = () => {
     }
   };
 
+  const handleLoadMoreThreatHuntIOCs = async () => {
+    const token = localStorage.getItem('admin_token');
+    try {
+      const response = await axios.get(`${API}/admin/threat-hunt-iocs`, {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { skip: iocNextSkip }
+      });
+      setThreatHuntIOCs([...threatHuntIOCs, ...response.data.iocs]);
+      setIocStats(response.data.stats);
+      setIocNextSkip(response.data.next_skip);
+    } catch (error) {
+      toast.error('Failed to load more IOCs');
+    }
+  };
+
   const addIOC = () => {
     setYaraIOCs([...yaraIOCs, { type: 'hash', value: '' }]);
   };
@@ -398,6 +415,13 @@ const AdminDashboard = () => {
                     ))}
                   </div>
                 )}
+                {iocNextSkip !== null && iocNextSkip !== undefined && (
+                  <div className="iocs-load-more">
+                    <Button variant="outline" onClick={handleLoadMoreThreatHuntIOCs}>
+                      Load more ({threatHuntIOCs.length} of {iocStats.total || 0})
+                    </Button>
+                  </div>
+                )}
               </div>
             </div>
           </TabsContent>
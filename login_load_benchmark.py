@@ -0,0 +1,99 @@
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+import aiohttp
+
+class LoginLoadBenchmark:
+    """Measures dashboard latency while concurrent logins keep bcrypt busy"""
+
+    def __init__(self, base_url="https://intellisecure-1.preview.emergentagent.com",
+                 login_concurrency=20, dashboard_requests=200, duration_seconds=30):
+        self.base_url = base_url
+        self.api_url = f"{base_url}/api"
+        self.login_concurrency = login_concurrency
+        self.dashboard_requests = dashboard_requests
+        self.duration_seconds = duration_seconds
+        self.token = None
+        self.email = None
+        self.password = "BenchPass123!"
+        self.login_count = 0
+
+    async def register_user(self, session):
+        timestamp = datetime.now().strftime('%H%M%S%f')
+        self.email = f"bench_user_{timestamp}@intellisecure.com"
+        payload = {
+            "email": self.email,
+            "password": self.password,
+            "company_name": "Benchmark Corp",
+            "company_size": "Medium",
+            "num_employees": 150,
+            "industry": "Technology",
+            "region": "North America",
+            "applied_policies": ["SOC2"],
+            "restrictions": [],
+            "security_solutions": ["SIEM", "EDR"]
+        }
+        async with session.post(f"{self.api_url}/auth/register", json=payload) as response:
+            data = await response.json()
+            if response.status != 200:
+                raise RuntimeError(f"Registration failed: {response.status} {data}")
+            self.token = data["token"]
+
+    async def login_loop(self, session, stop_at):
+        credentials = {"email": self.email, "password": self.password}
+        while time.monotonic() < stop_at:
+            async with session.post(f"{self.api_url}/auth/login", json=credentials) as response:
+                await response.read()
+                self.login_count += 1
+
+    async def measure_dashboard(self, session, count):
+        headers = {"Authorization": f"Bearer {self.token}"}
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            async with session.get(f"{self.api_url}/dashboard/stats", headers=headers) as response:
+                await response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+        return latencies
+
+    @staticmethod
+    def percentile(values, pct):
+        ordered = sorted(values)
+        index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def report(self, label, latencies):
+        print(f"   {label}: p50={self.percentile(latencies, 50):.1f}ms "
+              f"p95={self.percentile(latencies, 95):.1f}ms "
+              f"p99={self.percentile(latencies, 99):.1f}ms "
+              f"max={max(latencies):.1f}ms")
+
+    async def run(self):
+        async with aiohttp.ClientSession() as session:
+            await self.register_user(session)
+
+            print("\n🔍 Baseline dashboard latency (no login load)...")
+            baseline = await self.measure_dashboard(session, self.dashboard_requests // 4)
+            self.report("Baseline", baseline)
+
+            print(f"\n🔍 Dashboard latency with {self.login_concurrency} concurrent login loops...")
+            stop_at = time.monotonic() + self.duration_seconds
+            logins = [asyncio.create_task(self.login_loop(session, stop_at)) for _ in range(self.login_concurrency)]
+            loaded = await self.measure_dashboard(session, self.dashboard_requests)
+            await asyncio.gather(*logins)
+            self.report("Under load", loaded)
+            print(f"   Logins completed: {self.login_count}")
+
+            ratio = self.percentile(loaded, 99) / max(self.percentile(baseline, 99), 1)
+            print(f"\n📊 p99 under load is {ratio:.1f}x baseline")
+            return 0
+
+def main():
+    base_url = sys.argv[1] if len(sys.argv) > 1 else "https://intellisecure-1.preview.emergentagent.com"
+    benchmark = LoginLoadBenchmark(base_url=base_url)
+    return asyncio.run(benchmark.run())
+
+if __name__ == "__main__":
+    sys.exit(main())